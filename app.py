@@ -1,18 +1,76 @@
 import streamlit as st
 from pathlib import Path
-from PIL import Image
-import io
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm
-import json
 import datetime
+import functools
 import os
-import sqlite3
+import re
+import io
+import threading
+from itertools import islice
+
+import blobs
+import docstore
+import geo
+import letter_schedule
+import love_notes
+import media_cache
+import media_info
+import media_server
+import message_store
+import metrics
+import search_index
+import timeline
+import webhooks
 
 # Page config
 st.set_page_config(page_title="For Lina 💖", page_icon="❤️", layout="centered")
 
+# Opt-in instrumentation (see metrics.py): DEBUG_METRICS=1, or open the app once with ?debug=1.
+# Each rerun's timings and I/O counters go to the sidebar and to METRICS_FILE.
+if st.query_params.get('debug') == '1':
+    st.session_state.debug_metrics = True
+DEBUG_METRICS = os.getenv('DEBUG_METRICS') == '1' or st.session_state.get('debug_metrics', False)
+METRICS_FILE = Path(os.getenv('METRICS_FILE', 'metrics.jsonl'))
+METRICS_FILE_MB = int(os.getenv('METRICS_FILE_MB', '5'))
+if DEBUG_METRICS:
+    # a widget callback may have started collecting already, just before this run
+    (metrics.current() or metrics.start()).label = 'script'
+
+
+def collect_callback_metrics():
+    # callbacks run before the script or fragment rerun they trigger; counting starts
+    # here so their I/O lands in that rerun's record
+    if DEBUG_METRICS and metrics.current() is None:
+        metrics.start()
+
+
+def measured_fragment(name):
+    """Time a fragment as a section of the script run, or as a record of its own.
+
+    When only the fragment reruns, there is no script run to record it. In that
+    case the fragment records itself to METRICS_FILE and in a caption, because
+    fragments can't write to the sidebar.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            m = metrics.current()
+            if not DEBUG_METRICS or (m is not None and m.label == 'script'):
+                with metrics.section(name):
+                    return func(*args, **kwargs)
+            (m or metrics.start()).label = f'fragment: {name}'
+            try:
+                with metrics.section(name):
+                    result = func(*args, **kwargs)
+            finally:
+                run = metrics.finish()
+            metrics.append_jsonl(METRICS_FILE, run, METRICS_FILE_MB * 1024 * 1024)
+            counters = ', '.join(f'{k} {v}' for k, v in run['counters'].items())
+            st.caption(f"Fragment rerun: {run['total_ms']:.1f} ms" + (f' · {counters}' if counters else ''))
+            return result
+        return wrapper
+    return decorate
+
 # Styles
 RED_BG = "#ffedf0"
 ACCENT = "#d81b60"  # deep pink/red
@@ -60,222 +118,192 @@ st.markdown("<h1>For Lina <span class='heart-decor'>❤️</span></h1>", unsafe_
 st.markdown("<h3 style='color:#b71c46'>My beautiful cutie pie <span class='heart-decor'>💞</span></h3>", unsafe_allow_html=True)
 st.markdown("</div>", unsafe_allow_html=True)
 
-# Top tabs
-tab = st.tabs(["Home", "Play", "Messages", "Songs", "Journal", "Map", "Letters", "Countdowns", "Private"])
-
 # Messages storage
 MESSAGES_FILE = Path("messages.json")
 # Storage backend: 'file' (default) or 'sqlite'
 STORAGE = os.getenv('MESSAGE_STORAGE', 'file').lower()
 DB_FILE = Path("messages.db")
+# Chat images uploaded before the blob store (see blobs.py)
+MESSAGE_MEDIA_DIR = Path('message_media')
+# How many chat bubbles are loaded at a time; older ones come in pages of the same size
+CHAT_PAGE_SIZE = 50
+# Width of the downscaled copies shown for journal and map photos
+PREVIEW_WIDTH = 1024
+# The Home image sits in a third of the centered layout
+HERO_WIDTH = 480
 
 
-def init_db():
-    DB_FILE.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_FILE))
-    c = conn.cursor()
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT,
-            recipient TEXT,
-            text TEXT,
-            time TEXT,
-            read INTEGER
-        )
-        """
-    )
-    conn.commit()
-    conn.close()
-
-
-def load_messages():
-    if STORAGE == 'sqlite':
-        if not DB_FILE.exists():
-            return []
-        conn = sqlite3.connect(str(DB_FILE))
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute("SELECT id, sender as 'from', recipient as 'to', text, time, read FROM messages ORDER BY id ASC")
-        rows = c.fetchall()
-        msgs = []
-        for r in rows:
-            msgs.append({'from': r['from'], 'to': r['to'], 'text': r['text'], 'time': r['time'], 'read': bool(r['read'])})
-        conn.close()
-        return msgs
-
-    # default: file
-    if MESSAGES_FILE.exists():
-        try:
-            return json.loads(MESSAGES_FILE.read_text(encoding='utf-8'))
-        except Exception:
-            return []
-    return []
+@st.cache_resource
+def get_message_store(storage: str):
+    # one store per process: the sqlite backend keeps its connection pool here
+    # and runs schema setup only once
+    return message_store.open_store(storage, messages_file=MESSAGES_FILE, db_file=DB_FILE)
 
 
-def add_message(msg):
-    if STORAGE == 'sqlite':
-        init_db()
-        conn = sqlite3.connect(str(DB_FILE))
-        c = conn.cursor()
-        c.execute("INSERT INTO messages (sender, recipient, text, time, read) VALUES (?, ?, ?, ?, ?)",
-                  (msg.get('from'), msg.get('to'), msg.get('text'), msg.get('time'), int(bool(msg.get('read')))))
-        conn.commit()
-        conn.close()
-        return
+def load_messages(before_id=None, limit=None):
+    return get_message_store(STORAGE).load_messages(before_id, limit)
 
-    # file backend: read-modify-write
-    msgs = []
-    if MESSAGES_FILE.exists():
-        try:
-            msgs = json.loads(MESSAGES_FILE.read_text(encoding='utf-8'))
-        except Exception:
-            msgs = []
-    msgs.append(msg)
-    try:
-        MESSAGES_FILE.write_text(json.dumps(msgs, ensure_ascii=False, indent=2), encoding='utf-8')
-    except Exception:
-        pass
-
-
-def mark_all_read():
-    if STORAGE == 'sqlite':
-        if not DB_FILE.exists():
-            return
-        conn = sqlite3.connect(str(DB_FILE))
-        c = conn.cursor()
-        c.execute("UPDATE messages SET read = 1 WHERE recipient = ? AND read = 0", ('You',))
-        conn.commit()
-        conn.close()
-        return
 
-    # file
-    msgs = []
-    if MESSAGES_FILE.exists():
-        try:
-            msgs = json.loads(MESSAGES_FILE.read_text(encoding='utf-8'))
-        except Exception:
-            msgs = []
-    changed = False
-    for m in msgs:
-        if m.get('to') == 'You' and not m.get('read'):
-            m['read'] = True
-            changed = True
-    if changed:
-        try:
-            MESSAGES_FILE.write_text(json.dumps(msgs, ensure_ascii=False, indent=2), encoding='utf-8')
-        except Exception:
-            pass
+def add_message(msg):
+    return get_message_store(STORAGE).add_message(msg)
 
 
-def save_messages_file(msgs):
-    try:
-        MESSAGES_FILE.write_text(json.dumps(msgs, ensure_ascii=False, indent=2), encoding='utf-8')
-    except Exception:
-        pass
+def sync_messages():
+    # pull only what other sessions added since our newest message, and only when
+    # the store reports a change (file stat / sqlite data_version)
+    store = get_message_store(STORAGE)
+    token = store.change_token()
+    if token == st.session_state.get('msg_token'):
+        return
+    st.session_state.msg_token = token
+    last_id = st.session_state.messages[-1]['id'] if st.session_state.messages else 0
+    for m in store.fetch_messages_since(last_id):
+        if m['id'] not in st.session_state.msg_index:
+            st.session_state.messages.append(m)
+            st.session_state.msg_index[m['id']] = m
 
 
-def find_message_index_by_time(msgs, time_str):
-    for idx, m in enumerate(msgs):
-        if m.get('time') == time_str:
-            return idx
-    return None
+def mark_all_read(recipient='Youssef'):
+    get_message_store(STORAGE).mark_all_read(recipient)
 
 
-def add_reply(parent_time, reply_msg):
-    # file backend only (keeps simple)
-    msgs = []
-    if MESSAGES_FILE.exists():
-        try:
-            msgs = json.loads(MESSAGES_FILE.read_text(encoding='utf-8'))
-        except Exception:
-            msgs = []
-    idx = find_message_index_by_time(msgs, parent_time)
-    if idx is None:
+def add_reply(parent_id, reply_msg):
+    reply_id = get_message_store(STORAGE).add_reply(parent_id, reply_msg)
+    if reply_id is None:
         return False
-    parent = msgs[idx]
-    parent.setdefault('replies', [])
-    parent['replies'].append(reply_msg)
-    save_messages_file(msgs)
     # update session state copy
-    for m in st.session_state.messages:
-        if m.get('time') == parent_time:
-            m.setdefault('replies', [])
-            m['replies'].append(reply_msg)
-            break
+    parent = st.session_state.msg_index.get(parent_id)
+    if parent is not None:
+        parent.setdefault('replies', []).append(dict(reply_msg, id=reply_id))
     return True
 
 
-def add_reaction(parent_time, emoji, who):
-    msgs = []
-    if MESSAGES_FILE.exists():
-        try:
-            msgs = json.loads(MESSAGES_FILE.read_text(encoding='utf-8'))
-        except Exception:
-            msgs = []
-    idx = find_message_index_by_time(msgs, parent_time)
-    if idx is None:
+def add_reaction(parent_id, emoji, who):
+    if not get_message_store(STORAGE).add_reaction(parent_id, emoji, who):
         return False
-    parent = msgs[idx]
-    reacts = parent.setdefault('reactions', {})
-    reacts[emoji] = reacts.get(emoji, 0) + 1
-    save_messages_file(msgs)
     # update session state copy
-    for m in st.session_state.messages:
-        if m.get('time') == parent_time:
-            m.setdefault('reactions', {})
-            m['reactions'][emoji] = m['reactions'].get(emoji, 0) + 1
-            break
+    parent = st.session_state.msg_index.get(parent_id)
+    if parent is not None:
+        reacts = parent.setdefault('reactions', {})
+        reacts[emoji] = reacts.get(emoji, 0) + 1
     return True
 
 
+@st.cache_resource
+def get_webhook_dispatcher(url):
+    return webhooks.WebhookDispatcher(url, spool_path='webhook_spool.jsonl')
+
+
 def notify_webhook(entry):
+    # hands the event to a background worker; never waits on the network
     url = os.getenv('WEBHOOK_URL')
     if not url:
         return
+    get_webhook_dispatcher(url).submit(entry)
+
+
+def show_image(path, width=None, key=None):
+    # show a cached downscaled copy; the original is only sent when asked for.
+    # key tells apart several places showing the same (deduplicated) file
+    path = Path(path)
+    key = f'full_{key or path}'
+    metrics.count('media_elements')
+    thumb = media_cache.thumbnail(path, width * 2 if width else PREVIEW_WIDTH)
+    if thumb is None or st.session_state.get(key):
+        st.image(str(path), width=width or 'stretch')
+    else:
+        st.image(str(thumb), width=width or 'stretch')
+    if thumb is not None:
+        st.checkbox('Full size', key=key)
+
+
+def file_stamp(path):
+    # (mtime, size) of a data file, used as the cache key of indexes built from it
     try:
-        import json as _json
-        from urllib import request as _request
-        req = _request.Request(url, data=_json.dumps(entry).encode('utf-8'), headers={'Content-Type': 'application/json'})
-        _request.urlopen(req, timeout=2)
-    except Exception:
-        pass
+        s = Path(path).stat()
+    except OSError:
+        return None
+    return (s.st_mtime_ns, s.st_size)
 
 
-# Initialize session state
-if 'messages' not in st.session_state:
-    st.session_state.messages = load_messages()
-if 'unread' not in st.session_state:
-    st.session_state.unread = sum(1 for m in st.session_state.messages if (m.get('to') == 'You' and not m.get('read', False)))
-if 'ttt_board' not in st.session_state:
-    st.session_state.ttt_board = [""] * 9
-    st.session_state.ttt_turn = 'X'
-    st.session_state.ttt_winner = None
+@st.cache_data(max_entries=1)
+def pick_hero_image(root_mtime_ns):
+    # root_mtime_ns is only the cache key: adding or removing a file in the project
+    # root changes the directory mtime and re-runs the scan
+    assets = [p for p in Path('.').glob('*') if p.suffix.lower() in ['.png', '.jpg', '.jpeg']]
+    for p in assets:
+        if 'lina' in p.name.lower() or 'cutie' in p.name.lower() or 'good' in p.name.lower() or 'rose' in p.name.lower():
+            return p.name
+    return assets[0].name if assets else None
+
+
+@st.cache_resource(max_entries=4)
+def hero_image(name, mtime_ns):
+    # decoded and downscaled once per process, then kept as encoded bytes
+    thumb = media_cache.thumbnail(name, HERO_WIDTH)
+    return (thumb or Path(name)).read_bytes()
+
+
+# Optional local media server for recordings and videos (see media_server.py).
+# MEDIA_BASE_URL is the address browsers use to reach it when that differs from localhost.
+MEDIA_SERVER_PORT = os.getenv('MEDIA_SERVER_PORT')
+MEDIA_BASE_URL = os.getenv('MEDIA_BASE_URL') or (f"http://localhost:{MEDIA_SERVER_PORT}" if MEDIA_SERVER_PORT else None)
+
+
+@st.cache_resource
+def get_media_server():
+    try:
+        return media_server.start(os.getenv('MEDIA_SERVER_HOST', '127.0.0.1'), int(MEDIA_SERVER_PORT))
+    except OSError:
+        # already bound, e.g. by a standalone media_server.py
+        return None
+
+
+def media_src(path):
+    # URL on the media server when one is configured, otherwise the local path
+    metrics.count('media_elements')
+    if not MEDIA_BASE_URL:
+        return str(path)
+    if MEDIA_SERVER_PORT:
+        get_media_server()
+    return media_server.url_for(MEDIA_BASE_URL, path)
+
+
+def init_message_state():
+    if 'messages' not in st.session_state:
+        st.session_state.msg_token = get_message_store(STORAGE).change_token()
+        # only the newest page; older pages are fetched on demand from the Messages tab
+        st.session_state.messages = load_messages(limit=CHAT_PAGE_SIZE)
+        st.session_state.has_older = len(st.session_state.messages) == CHAT_PAGE_SIZE
+        # id -> message, so replies and reactions update the session copy without a scan
+        st.session_state.msg_index = {m['id']: m for m in st.session_state.messages}
+
+
+# Streamlit forgets a widget's value on runs where the widget isn't drawn, i.e.
+# whenever another section is open. Writing these keys back each run keeps
+# drafts and picks across section switches.
+PERSISTENT_KEYS = [
+    'love_note_text', 'love_note_sender', 'game', 'p1', 'p2', 'send_as', 'composer_text', 'song_uploader',
+    'journal_title', 'journal_note', 'map_place', 'map_coords', 'map_note', 'letter_text', 'letter_unlock',
+    'letter_date', 'count_name', 'count_date', 'journal_month', 'map_level', 'map_find', 'map_near', 'map_radius',
+    'map_area', 'search_query', 'search_kind',
+]
+for _key in PERSISTENT_KEYS:
+    if _key in st.session_state:
+        st.session_state[_key] = st.session_state[_key]
 
 # --------------------------
 # Home tab
 # --------------------------
-with tab[0]:
-
-
+def render_home():
     # Left: image if available
-    assets = [p for p in Path('.').glob('*') if p.suffix.lower() in ['.png', '.jpg', '.jpeg']]
-    selected_image = None
-    if assets:
-        for p in assets:
-            if 'lina' in p.name.lower() or 'cutie' in p.name.lower() or 'good' in p.name.lower() or 'rose' in p.name.lower():
-                selected_image = p
-                break
-        if not selected_image:
-            selected_image = assets[0]
-
     col1, col2 = st.columns([1, 2])
-    with col1:
+    with col1, metrics.section('hero image'):
+        selected_image = pick_hero_image(Path('.').stat().st_mtime_ns)
         if selected_image:
             try:
-                img = Image.open(selected_image)
-                st.image(img, width='stretch', caption=selected_image.name)
+                st.image(hero_image(selected_image, Path(selected_image).stat().st_mtime_ns), width='stretch',
+                         caption=selected_image)
             except Exception:
                 st.write(":heart: image preview not available")
         else:
@@ -301,139 +329,140 @@ with tab[0]:
     # Printable love note — hidden inside an expander to avoid occupying top of the page
     with st.expander('Printable love note'):
         st.markdown("<h2 style='text-align:center;'>Printable love note</h2>", unsafe_allow_html=True)
-        custom_message = st.text_area('Customize the note for Lina', value="Lina, you are my sunshine. I love you.")
-        sender_name = st.text_input("Sender name", value="From, your love")
-
-        def create_pdf(message: str, sender: str) -> bytes:
-            buffer = io.BytesIO()
-            c = canvas.Canvas(buffer, pagesize=A4)
-            width, height = A4
-
-            # Draw a soft red border
-            c.setStrokeColorRGB(0.85, 0.18, 0.35)
-            c.setLineWidth(4)
-            margin = 15 * mm
-            c.rect(margin, margin, width - 2*margin, height - 2*margin)
-
-            # Title
-            c.setFont('Helvetica-Bold', 28)
-            c.setFillColorRGB(0.82, 0.11, 0.35)
-            c.drawCentredString(width/2, height - 50*mm, 'For Lina')
-
-            # Message
-            textobject = c.beginText()
-            textobject.setTextOrigin(30*mm, height - 80*mm)
-            textobject.setFont('Times-Roman', 14)
-            textobject.setFillColorRGB(0.3, 0, 0.05)
-            for line in message.split('\n'):
-                textobject.textLine(line)
-            c.drawText(textobject)
-
-            # Sender
-            c.setFont('Times-Italic', 12)
-            c.drawRightString(width - 30*mm, 30*mm, sender)
-
-            c.showPage()
-            c.save()
-            buffer.seek(0)
-            return buffer.read()
+        st.session_state.setdefault('love_note_text', "Lina, you are my sunshine. I love you.")
+        st.session_state.setdefault('love_note_sender', "From, your love")
+        custom_message = st.text_area('Customize the note for Lina', key='love_note_text')
+        sender_name = st.text_input("Sender name", key='love_note_sender')
 
         if st.button('Generate & download PDF'):
-            pdf_bytes = create_pdf(custom_message, sender_name)
+            pdf_bytes = love_notes.render_note_pdf(custom_message, sender_name)
             st.download_button('Download love note (PDF)', data=pdf_bytes, file_name='For_Lina_note.pdf', mime='application/pdf')
 
 # --------------------------
 # Play tab: mini-games + ideas
 # --------------------------
-with tab[1]:
-    st.markdown("<h2 style='text-align:center;'>Play together</h2>", unsafe_allow_html=True)
-    st.write("Choose a mini-game to play together:")
+# Each game is a fragment: a click reruns only that game, not the rest of the app
+def ttt_move(idx):
+    board = st.session_state.ttt_board
+    if st.session_state.ttt_winner or board[idx]:
+        return
+    board[idx] = st.session_state.ttt_turn
+    # toggle
+    st.session_state.ttt_turn = 'O' if st.session_state.ttt_turn == 'X' else 'X'
+    # check winner
+    wins = [(0,1,2),(3,4,5),(6,7,8),(0,3,6),(1,4,7),(2,5,8),(0,4,8),(2,4,6)]
+    for a,b,c in wins:
+        if board[a] and board[a] == board[b] == board[c]:
+            st.session_state.ttt_winner = board[a]
+            break
+    if all(board) and not st.session_state.ttt_winner:
+        st.session_state.ttt_winner = 'Draw'
+
+
+def ttt_reset():
+    st.session_state.ttt_board = [""]*9
+    st.session_state.ttt_turn = 'X'
+    st.session_state.ttt_winner = None
 
-    game = st.selectbox("Mini-game", ["Tic-Tac-Toe", "Rock-Paper-Scissors", "Guess a Number (co-op)"])
 
+@st.fragment
+@measured_fragment('tic-tac-toe')
+def tic_tac_toe():
     # Tic-Tac-Toe
-    if game == "Tic-Tac-Toe":
-        st.write("Two-player Tic-Tac-Toe. Click a cell to place X/O.")
-        board = st.session_state.ttt_board
-        winner = st.session_state.ttt_winner
+    st.write("Two-player Tic-Tac-Toe. Click a cell to place X/O.")
+    board = st.session_state.ttt_board
+
+    # moves are applied in on_click, before the board is drawn
+    cols = st.columns(3)
+    for i in range(3):
+        for j in range(3):
+            idx = i*3 + j
+            label = board[idx] if board[idx] else ""
+            cols[j].button(label or " ", key=f"cell_{idx}", on_click=ttt_move, args=(idx,))
+    if st.session_state.ttt_winner:
+        if st.session_state.ttt_winner == 'Draw':
+            st.info("It's a draw!")
+        else:
+            st.success(f"{st.session_state.ttt_winner} wins!")
+        st.button('Reset Tic-Tac-Toe', on_click=ttt_reset)
 
-        cols = st.columns(3)
-        for i in range(3):
-            for j in range(3):
-                idx = i*3 + j
-                label = board[idx] if board[idx] else ""
-                if cols[j].button(label or " ", key=f"cell_{idx}") and not winner:
-                    if not board[idx]:
-                        board[idx] = st.session_state.ttt_turn
-                        # toggle
-                        st.session_state.ttt_turn = 'O' if st.session_state.ttt_turn == 'X' else 'X'
-                        # check winner
-                        wins = [(0,1,2),(3,4,5),(6,7,8),(0,3,6),(1,4,7),(2,5,8),(0,4,8),(2,4,6)]
-                        for a,b,c in wins:
-                            if board[a] and board[a] == board[b] == board[c]:
-                                st.session_state.ttt_winner = board[a]
-                                break
-                        if all(board) and not st.session_state.ttt_winner:
-                            st.session_state.ttt_winner = 'Draw'
-        if st.session_state.ttt_winner:
-            if st.session_state.ttt_winner == 'Draw':
-                st.info("It's a draw!")
-            else:
-                st.success(f"{st.session_state.ttt_winner} wins!")
-            if st.button('Reset Tic-Tac-Toe'):
-                st.session_state.ttt_board = [""]*9
-                st.session_state.ttt_turn = 'X'
-                st.session_state.ttt_winner = None
 
+def rps_reset():
+    st.session_state.rps_p1 = None
+    st.session_state.rps_p2 = None
+
+
+@st.fragment
+@measured_fragment('rock-paper-scissors')
+def rock_paper_scissors():
     # Rock-Paper-Scissors (two-player on same screen)
-    if game == "Rock-Paper-Scissors":
-        st.write("Two-player RPS: Player 1 picks, then Player 2 picks.")
-        if 'rps_p1' not in st.session_state:
-            st.session_state.rps_p1 = None
-            st.session_state.rps_p2 = None
-        p1 = st.selectbox("Player 1 pick", ["", "Rock", "Paper", "Scissors"], key='p1')
-        if st.button('Lock Player 1 pick'):
-            st.session_state.rps_p1 = p1
-        if st.session_state.rps_p1:
-            st.write(f"Player 1 locked: {st.session_state.rps_p1}")
-            p2 = st.selectbox("Player 2 pick", ["", "Rock", "Paper", "Scissors"], key='p2')
-            if st.button('Lock Player 2 pick'):
-                st.session_state.rps_p2 = p2
-            if st.session_state.rps_p2:
-                p1v = st.session_state.rps_p1
-                p2v = st.session_state.rps_p2
-                outcome = None
-                if p1v == p2v:
-                    outcome = 'Draw'
-                elif (p1v, p2v) in [('Rock','Scissors'), ('Scissors','Paper'), ('Paper','Rock')]:
-                    outcome = 'Player 1 wins'
-                else:
-                    outcome = 'Player 2 wins'
-                st.success(outcome)
-                if st.button('Reset RPS'):
-                    st.session_state.rps_p1 = None
-                    st.session_state.rps_p2 = None
+    st.write("Two-player RPS: Player 1 picks, then Player 2 picks.")
+    if 'rps_p1' not in st.session_state:
+        st.session_state.rps_p1 = None
+        st.session_state.rps_p2 = None
+    p1 = st.selectbox("Player 1 pick", ["", "Rock", "Paper", "Scissors"], key='p1')
+    if st.button('Lock Player 1 pick'):
+        st.session_state.rps_p1 = p1
+    if st.session_state.rps_p1:
+        st.write(f"Player 1 locked: {st.session_state.rps_p1}")
+        p2 = st.selectbox("Player 2 pick", ["", "Rock", "Paper", "Scissors"], key='p2')
+        if st.button('Lock Player 2 pick'):
+            st.session_state.rps_p2 = p2
+        if st.session_state.rps_p2:
+            p1v = st.session_state.rps_p1
+            p2v = st.session_state.rps_p2
+            outcome = None
+            if p1v == p2v:
+                outcome = 'Draw'
+            elif (p1v, p2v) in [('Rock','Scissors'), ('Scissors','Paper'), ('Paper','Rock')]:
+                outcome = 'Player 1 wins'
+            else:
+                outcome = 'Player 2 wins'
+            st.success(outcome)
+            st.button('Reset RPS', on_click=rps_reset)
 
+
+@st.fragment
+@measured_fragment('guess the number')
+def guess_number():
     # Guess a Number (co-op)
+    st.write("One sets a secret number (1-50) and the other guesses with hints")
+    if 'secret' not in st.session_state:
+        st.session_state.secret = None
+    if st.session_state.secret is None:
+        secret = st.number_input('Set secret number (Player A) — keep it private', min_value=1, max_value=50, step=1, key='secret_set')
+        if st.button('Set Secret'):
+            st.session_state.secret = int(secret)
+            st.success('Secret set — now Player B can guess')
+    else:
+        guess = st.number_input('Guess the number (Player B)', min_value=1, max_value=50, step=1, key='guess')
+        if st.button('Submit Guess'):
+            if guess == st.session_state.secret:
+                st.success('Correct!')
+                st.session_state.secret = None
+            elif guess < st.session_state.secret:
+                st.info('Higher')
+            else:
+                st.info('Lower')
+
+
+def render_play():
+    if 'ttt_board' not in st.session_state:
+        st.session_state.ttt_board = [""] * 9
+        st.session_state.ttt_turn = 'X'
+        st.session_state.ttt_winner = None
+
+    st.markdown("<h2 style='text-align:center;'>Play together</h2>", unsafe_allow_html=True)
+    st.write("Choose a mini-game to play together:")
+
+    game = st.selectbox("Mini-game", ["Tic-Tac-Toe", "Rock-Paper-Scissors", "Guess a Number (co-op)"], key='game')
+
+    if game == "Tic-Tac-Toe":
+        tic_tac_toe()
+    if game == "Rock-Paper-Scissors":
+        rock_paper_scissors()
     if game == "Guess a Number (co-op)":
-        st.write("One sets a secret number (1-50) and the other guesses with hints")
-        if 'secret' not in st.session_state:
-            st.session_state.secret = None
-        if st.session_state.secret is None:
-            secret = st.number_input('Set secret number (Player A) — keep it private', min_value=1, max_value=50, step=1, key='secret_set')
-            if st.button('Set Secret'):
-                st.session_state.secret = int(secret)
-                st.success('Secret set — now Player B can guess')
-        else:
-            guess = st.number_input('Guess the number (Player B)', min_value=1, max_value=50, step=1, key='guess')
-            if st.button('Submit Guess'):
-                if guess == st.session_state.secret:
-                    st.success('Correct!')
-                    st.session_state.secret = None
-                elif guess < st.session_state.secret:
-                    st.info('Higher')
-                else:
-                    st.info('Lower')
+        guess_number()
 
     st.markdown('---')
     st.write('More mini-game ideas:')
@@ -445,22 +474,56 @@ with tab[1]:
 # --------------------------
 # Messages tab
 # --------------------------
-with tab[2]:
-    st.markdown("<h2 style='text-align:center;'>Messages <span class='heart-decor'>💌</span></h2>", unsafe_allow_html=True)
-    st.markdown("<div style='text-align:center; color:#7a1128;'>Send messages to each other — messages are stored locally in this folder as <code>messages.json</code></div>", unsafe_allow_html=True)
-    st.markdown('')
-
-    # Sidebar quick controls
-    sender = st.selectbox('Send as', ['Youssef', 'Lina'])
-    recipient = 'Lina' if sender == 'Youssef' else 'Youssef'
-
-    # If a previous send requested the composer be cleared, do it before creating the widget
-    if st.session_state.pop('clear_composer', False):
-        # Safe to assign because the widget hasn't been created yet on this run
-        st.session_state['composer_text'] = ''
+def send_message(sender, recipient):
+    collect_callback_metrics()
+    msg_text = st.session_state.get('composer_text', '')
+    img_upload = st.session_state.get(f"msg_images_{st.session_state.upload_gen}")
+    if not (msg_text.strip() or (img_upload and len(img_upload) > 0)):
+        return
+    entry = {
+        'from': sender,
+        'to': recipient,
+        'text': msg_text.strip(),
+        'time': datetime.datetime.utcnow().isoformat(),
+        'read': False,
+        'images': []
+    }
+
+    # attached images go to the blob store; the message keeps their refs
+    if img_upload:
+        for f in img_upload:
+            try:
+                ref, _, _ = blobs.save_upload(f)
+                entry['images'].append(ref)
+            except Exception:
+                pass
 
-    # Ensure composer state exists so we can reference it
+    # persist, then append to session under the id the store assigned
+    try:
+        entry['id'] = add_message(entry)
+    except OSError as e:
+        # nothing was stored; keep the text in the composer so it can be sent again
+        st.session_state['message_failed'] = str(e)
+        return
+    st.session_state.messages.append(entry)
+    st.session_state.msg_index[entry['id']] = entry
+    notify_webhook(entry)
+    index_sent_message(entry)
+    # callbacks run before widgets are created, so the composer can be cleared directly;
+    # a new uploader key empties the attachments
+    st.session_state['composer_text'] = ''
+    st.session_state.upload_gen += 1
+    st.session_state['message_sent'] = True
+    # redraw only the composer and the chat list
+    st.rerun(['composer', 'chat_list'])
+
+
+@st.fragment(key='composer')
+@measured_fragment('composer')
+def message_composer(sender, recipient):
+    # typing, emoji clicks and attaching rerun only this fragment
     st.session_state.setdefault('composer_text', '')
+    st.session_state.setdefault('upload_gen', 0)
     # quick emoji picker
     emojis = ['❤️','😘','😊','😍','🎶','😭','👍']
     cols = st.columns(len(emojis))
@@ -471,58 +534,57 @@ with tab[2]:
 
     # image attachments
     st.write('Attach image(s) (optional)')
-    img_upload = st.file_uploader('', type=['png','jpg','jpeg','gif'], accept_multiple_files=True, key='msg_images')
-
-    msg_text = st.text_area('Message', height=100, key='composer_text')
-    if st.button('Send') and (msg_text.strip() or (img_upload and len(img_upload) > 0)):
-        entry = {
-            'from': sender,
-            'to': recipient,
-            'text': msg_text.strip(),
-            'time': datetime.datetime.utcnow().isoformat(),
-            'read': False,
-            'images': []
-        }
-
-        # save attached images to message_media/
-        MEDIA_DIR = Path('message_media')
-        MEDIA_DIR.mkdir(exist_ok=True)
-        if img_upload:
-            for f in img_upload:
-                try:
-                    data = f.read()
-                    ts = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
-                    safe_name = f"{ts}_{f.name}"
-                    dest = MEDIA_DIR / safe_name
-                    dest.write_bytes(data)
-                    entry['images'].append(safe_name)
-                except Exception:
-                    pass
-
-        # append to session and persist
-        st.session_state.messages.append(entry)
-        add_message(entry)
-        if entry['to'] == 'Youssef':
-            st.session_state.unread += 1
-        # Request the composer to be cleared on the next rerun to avoid modifying a widget-backed key
-        st.session_state['clear_composer'] = True
-        # clear uploader state where possible
-        try:
-            st.session_state['msg_images'] = None
-        except Exception:
-            pass
+    st.file_uploader('', type=['png','jpg','jpeg','gif'], accept_multiple_files=True,
+                     key=f"msg_images_{st.session_state.upload_gen}")
+
+    st.text_area('Message', height=100, key='composer_text')
+    st.button('Send', on_click=send_message, args=(sender, recipient))
+    if st.session_state.pop('message_sent', False):
         st.success('Message sent')
+    failed = st.session_state.pop('message_failed', None)
+    if failed:
+        st.error(f'Message not sent: {failed}')
 
-    st.markdown('---')
+
+def mark_read_clicked():
+    # runs before the chat list is drawn, so the badge is already cleared on this run
+    collect_callback_metrics()
+    if not get_message_store(STORAGE).count_unread('Youssef'):
+        return
+    mark_all_read('Youssef')
+    for m in st.session_state.messages:
+        if m.get('to') == 'Youssef':
+            m['read'] = True
+    st.session_state['marked_read'] = True
+
+
+@st.fragment(key='chat_list')
+@measured_fragment('chat list')
+def chat_list():
+    render_chat_list()
+
+
+def render_chat_list():
+    # also picks up messages from the other side whenever this fragment reruns
+    sync_messages()
 
     # Show unread count and chat zone
     st.markdown("<div style='max-height:360px; overflow:auto; padding:8px; border-radius:12px; background:linear-gradient(180deg,#fff,#fff6f8)'>", unsafe_allow_html=True)
-    if st.session_state.unread:
-        st.info(f'Youssef has {st.session_state.unread} unread message(s)')
+    # a counter kept by the store, not a scan of the history
+    unread = get_message_store(STORAGE).count_unread('Youssef')
+    if unread:
+        st.info(f'Youssef has {unread} unread message(s)')
+
+    # Older history is fetched a page at a time (keyset on id) and prepended to the window
+    if st.session_state.has_older and st.session_state.messages:
+        if st.button('Load older messages'):
+            older = load_messages(before_id=st.session_state.messages[0]['id'], limit=CHAT_PAGE_SIZE)
+            st.session_state.messages[:0] = older
+            st.session_state.msg_index.update((m['id'], m) for m in older)
+            st.session_state.has_older = len(older) == CHAT_PAGE_SIZE
 
     # List messages (render as chat bubbles) - always visible in chat zone (newest at bottom)
-    msgs = st.session_state.messages[:]  # oldest -> newest
-    for m in msgs:
+    for m in st.session_state.messages:  # oldest -> newest
         sender_name = m.get('from', '')
         is_me = (sender_name == 'Youssef')
         side_class = 'message-right' if is_me else 'message-left'
@@ -546,24 +608,37 @@ with tab[2]:
         try:
             imgs = m.get('images', []) or []
             for im in imgs:
-                p = Path('message_media') / im
+                # bare names are images saved to message_media/ before the blob store
+                p = blobs.resolve(im, MESSAGE_MEDIA_DIR)
                 if p.exists():
-                    st.image(str(p), width=240)
+                    show_image(p, width=240, key=f"msg_{m['id']}_{im}")
         except Exception:
             pass
     st.markdown("</div>", unsafe_allow_html=True)
 
     # Mark messages as read button
-    if st.button('Mark all as read'):
-        changed = False
-        for m in st.session_state.messages:
-            if m.get('to') == 'Youssef' and not m.get('read'):
-                m['read'] = True
-                changed = True
-        if changed:
-            mark_all_read()
-            st.session_state.unread = 0
-            st.success('Marked as read')
+    st.button('Mark all as read', on_click=mark_read_clicked)
+    if st.session_state.pop('marked_read', False):
+        st.success('Marked as read')
+
+
+def render_messages():
+    with metrics.section('load messages'):
+        init_message_state()
+
+    st.markdown("<h2 style='text-align:center;'>Messages <span class='heart-decor'>💌</span></h2>", unsafe_allow_html=True)
+    st.markdown("<div style='text-align:center; color:#7a1128;'>Send messages to each other — messages are stored locally in this folder as <code>messages.json</code></div>", unsafe_allow_html=True)
+    st.markdown('')
+
+    # Sidebar quick controls
+    sender = st.selectbox('Send as', ['Youssef', 'Lina'], key='send_as')
+    recipient = 'Lina' if sender == 'Youssef' else 'Youssef'
+
+    message_composer(sender, recipient)
+
+    st.markdown('---')
+
+    chat_list()
 
     st.markdown('---')
 
@@ -571,47 +646,81 @@ with tab[2]:
 # Songs tab
 # --------------------------
 SONGS_DIR = Path('songs')
-SONGS_DIR.mkdir(exist_ok=True)
 SONGS_META = Path('songs.json')
 
 def load_songs_meta():
-    if SONGS_META.exists():
-        try:
-            return json.loads(SONGS_META.read_text(encoding='utf-8'))
-        except Exception:
-            return {}
-    return {}
+    return docstore.load(SONGS_META, dict)
 
 def save_songs_meta(meta: dict):
+    docstore.save(SONGS_META, meta)
+
+# Songs listed per page, newest first
+SONGS_PAGE_SIZE = 20
+
+def song_label(info):
+    details = [d for d in (media_info.format_duration(info.get('duration')), media_info.format_size(info.get('size'))) if d]
+    label = f"**{info.get('orig_name')}** — uploaded by *{info.get('uploader')}* on {info.get('time')}"
+    return label + (f" · {' · '.join(details)}" if details else '')
+
+def song_player(audio_path):
     try:
-        SONGS_META.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding='utf-8')
+        suffix = audio_path.suffix.lower()
+        # Video formats -> use st.video, audio formats -> st.audio
+        if suffix in ['.mp4', '.webm', '.mov']:
+            try:
+                st.video(media_src(audio_path))
+            except Exception:
+                st.video(audio_path.read_bytes())
+        else:
+            try:
+                st.audio(media_src(audio_path))
+            except Exception:
+                # fallback to bytes
+                try:
+                    st.audio(audio_path.read_bytes())
+                except Exception:
+                    st.write('Unable to play this file in the browser.')
     except Exception:
-        pass
+        st.write('Unable to play this file in the browser.')
 
-with tab[3]:
+def render_songs():
     st.markdown("<h2 style='text-align:center;'>Songs</h2>", unsafe_allow_html=True)
     st.write("Upload voice recordings or short video recordings (mp3, wav, m4a, ogg, mp4) and play them here.")
 
     uploader_name = st.selectbox('Upload as', ['Youssef', 'Lina'], key='song_uploader')
-    uploaded = st.file_uploader('Upload recording(s)', type=['mp3', 'wav', 'm4a', 'ogg', 'mp4'], accept_multiple_files=True)
+    # a new key after each upload clears the widget, so later reruns don't save the files again
+    st.session_state.setdefault('song_upload_gen', 0)
+    uploaded = st.file_uploader('Upload recording(s)', type=['mp3', 'wav', 'm4a', 'ogg', 'mp4'], accept_multiple_files=True,
+                                key=f"song_upload_{st.session_state.song_upload_gen}")
+    for note in st.session_state.pop('song_upload_notes', []):
+        st.success(note)
     if uploaded:
         meta = load_songs_meta()
+        notes = []
         for f in uploaded:
             try:
-                data = f.read()
-                ts = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
-                safe_name = f"{ts}_{f.name}"
-                dest = SONGS_DIR / safe_name
-                dest.write_bytes(data)
-                meta[safe_name] = {
+                ref, sha256, size = blobs.save_upload(f)
+                song_id = f"{datetime.datetime.utcnow():%Y%m%d%H%M%S}_{f.name}"
+                while song_id in meta:
+                    song_id = '_' + song_id
+                meta[song_id] = {
+                    'blob': ref,
                     'orig_name': f.name,
                     'uploader': uploader_name,
-                    'time': datetime.datetime.utcnow().isoformat()
+                    'time': timeline.stamp(meta),
+                    'sha256': sha256,
+                    'size': size,
+                    # measured once here so the list never has to open the files
+                    'duration': media_info.duration_seconds(ref)
                 }
-                st.success(f"Uploaded {f.name}")
+                notes.append(f"Uploaded {f.name}")
             except Exception as e:
                 st.error(f"Failed to save {f.name}: {e}")
         save_songs_meta(meta)
+        st.session_state.song_upload_notes = notes
+        st.session_state.song_upload_gen += 1
+        st.session_state.songs_page = 0
+        st.rerun()
 
     st.markdown('---')
 
@@ -619,46 +728,54 @@ with tab[3]:
     meta = load_songs_meta()
     if not meta:
         st.info('No songs uploaded yet — use the uploader above to add recordings.')
-    else:
-        # sort by time desc
-        items = sorted(meta.items(), key=lambda kv: kv[1].get('time',''), reverse=True)
-        for i, (fname, info) in enumerate(items):
-            col1, col2 = st.columns([6,1])
-            with col1:
-                st.markdown(f"**{info.get('orig_name')}** — uploaded by *{info.get('uploader')}* on {info.get('time')}")
-                audio_path = SONGS_DIR / fname
+        return
+    pages = max(1, -(-len(meta) // SONGS_PAGE_SIZE))
+    page = min(st.session_state.get('songs_page', 0), pages - 1)
+    # newest first: songs.json is kept in upload order, so no sort is needed
+    newest = reversed(meta.items())
+    for fname, info in islice(newest, page * SONGS_PAGE_SIZE, (page + 1) * SONGS_PAGE_SIZE):
+        col1, col2 = st.columns([6,1])
+        with col1:
+            st.markdown(song_label(info))
+            # the player (and the file behind it) is only loaded once asked for
+            if st.toggle('Play', key=f'play_song_{fname}'):
+                # songs from before the blob store are files named after their key
+                audio_path = blobs.resolve(info.get('blob') or fname, SONGS_DIR)
                 if audio_path.exists():
-                    try:
-                        suffix = audio_path.suffix.lower()
-                        # Video formats -> use st.video, audio formats -> st.audio
-                        if suffix in ['.mp4', '.webm', '.mov']:
-                            try:
-                                st.video(str(audio_path))
-                            except Exception:
-                                st.video(audio_path.read_bytes())
-                        else:
-                            try:
-                                st.audio(str(audio_path))
-                            except Exception:
-                                # fallback to bytes
-                                try:
-                                    st.audio(audio_path.read_bytes())
-                                except Exception:
-                                    st.write('Unable to play this file in the browser.')
-                    except Exception:
-                        st.write('Unable to play this file in the browser.')
+                    song_player(audio_path)
+                    if info.get('duration') is None:
+                        # uploaded before durations were recorded (or couldn't be read then);
+                        # fill it in now the file is open anyway
+                        duration = media_info.duration_seconds(audio_path)
+                        if duration is not None:
+                            info['duration'] = duration
+                            info['size'] = info.get('size') or audio_path.stat().st_size
+                            save_songs_meta(meta)
                 else:
                     st.write('File missing on disk')
-            with col2:
-                if st.button(f'Delete_{i}'):
+        with col2:
+            if st.button('Delete', key=f'delete_song_{fname}'):
+                # a blob may be shared with another upload of the same file; the GC
+                # pass removes it once nothing refers to it
+                if not info.get('blob'):
                     try:
+                        audio_path = SONGS_DIR / fname
                         if audio_path.exists():
                             audio_path.unlink()
                     except Exception:
                         pass
-                    meta.pop(fname, None)
-                    save_songs_meta(meta)
-                    st.experimental_rerun()
+                meta.pop(fname, None)
+                save_songs_meta(meta)
+                st.rerun()
+    if pages > 1:
+        cols = st.columns(3)
+        if page > 0 and cols[0].button('Newer songs'):
+            st.session_state.songs_page = page - 1
+            st.rerun()
+        cols[1].caption(f'Page {page + 1} of {pages}')
+        if page < pages - 1 and cols[2].button('Older songs'):
+            st.session_state.songs_page = page + 1
+            st.rerun()
 
     st.markdown('---')
 
@@ -667,57 +784,104 @@ with tab[3]:
 # --------------------------
 # Digital Love Journal
 # --------------------------
-JOURNAL_DIR = Path('journal')
-JOURNAL_DIR.mkdir(exist_ok=True)
 JOURNAL_META = Path('journal.json')
 
 def load_journal():
-    if JOURNAL_META.exists():
-        try:
-            return json.loads(JOURNAL_META.read_text(encoding='utf-8'))
-        except Exception:
-            return []
-    return []
+    return docstore.load(JOURNAL_META, list)
 
 def save_journal(items):
+    docstore.save(JOURNAL_META, items)
+
+# Entries shown per page of a month
+JOURNAL_PAGE_SIZE = 10
+VIDEO_SUFFIXES = ['.mp4', '.mov', '.webm']
+MONTH_KEY = re.compile(r'\d{4}-\d{2}')
+
+@st.cache_resource(max_entries=1)
+def get_journal_months(stamp):
+    # stamp (mtime/size of journal.json) is only the cache key. Maps 'YYYY-MM' to the
+    # positions of that month's entries, newest month first, so a rerun only renders
+    # one page of one month instead of the whole journal.
+    months = {}
+    for i, it in enumerate(load_journal()):
+        key = timeline.time_of(it)[:7]
+        if not MONTH_KEY.fullmatch(key):
+            key = 'undated'
+        months.setdefault(key, []).append(i)
+    # 'undated' sorts after the digits, i.e. first when reversed; move it to the end
+    order = sorted((k for k in months if k != 'undated'), reverse=True)
+    if 'undated' in months:
+        order.append('undated')
+    return {k: months[k] for k in order}
+
+def month_label(key):
     try:
-        JOURNAL_META.write_text(json.dumps(items, ensure_ascii=False, indent=2), encoding='utf-8')
-    except Exception:
-        pass
+        return datetime.datetime.strptime(key, '%Y-%m').strftime('%B %Y')
+    except ValueError:
+        return key.capitalize()
+
+def journal_media(i, it):
+    # media is created only on request: a small thumbnail for photos, a play toggle for videos
+    p = blobs.resolve(it.get('media'))
+    if not p.exists():
+        return
+    if p.suffix.lower() in VIDEO_SUFFIXES:
+        if st.toggle('▶ Play video', key=f'play_journal_{i}'):
+            st.video(media_src(p))
+    else:
+        show_image(p, width=240, key=f'journal_{i}')
 
-with tab[4]:
+def render_journal():
     st.markdown("<h2 style='text-align:center;'>Digital Love Journal</h2>", unsafe_allow_html=True)
     st.write('Add timeline entries with photos, short videos, and notes.')
-    title = st.text_input('Title')
-    note = st.text_area('Note')
+    title = st.text_input('Title', key='journal_title')
+    note = st.text_area('Note', key='journal_note')
     media = st.file_uploader('Add photo/video (optional)', type=['png','jpg','jpeg','mp4','mov','webm'], key='journal_media')
     if st.button('Add entry'):
         items = load_journal()
-        ts = datetime.datetime.utcnow().isoformat()
+        ts = timeline.stamp(items)
         fname = None
-        if media:
-            safe = f"{datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{media.name}"
-            (JOURNAL_DIR / safe).write_bytes(media.read())
-            fname = str(JOURNAL_DIR / safe)
-        items.append({'title': title, 'note': note, 'media': fname, 'time': ts})
-        save_journal(items)
-        st.success('Entry added')
+        try:
+            if media:
+                fname, _, _ = blobs.save_upload(media)
+            items.append({'title': title, 'note': note, 'media': fname, 'time': ts})
+            save_journal(items)
+            refresh_search_index('journal')
+            st.success('Entry added')
+        except Exception as e:
+            st.error(f"Failed to save {media.name}: {e}")
     st.markdown('---')
     items = load_journal()
-    if not items:
+    months = get_journal_months(file_stamp(JOURNAL_META))
+    if not items or not months:
         st.info('No journal entries yet.')
-    else:
-        for it in sorted(items, key=lambda x: x.get('time',''), reverse=True):
-            st.markdown(f"**{it.get('title','')}** — {it.get('time')}")
-            st.write(it.get('note',''))
-            if it.get('media'):
-                p = Path(it.get('media'))
-                if p.exists():
-                    if p.suffix.lower() in ['.mp4','.mov','.webm']:
-                        st.video(str(p))
-                    else:
-                        st.image(str(p))
-            st.markdown('---')
+        return
+    month = st.selectbox('Month', list(months), format_func=lambda k: f"{month_label(k)} ({len(months[k])})",
+                         key='journal_month')
+    if st.session_state.get('journal_page_month') != month:
+        st.session_state.journal_page_month = month
+        st.session_state.journal_page = 0
+    positions = months[month]
+    pages = max(1, -(-len(positions) // JOURNAL_PAGE_SIZE))
+    page = min(st.session_state.journal_page, pages - 1)
+    # newest first within the month
+    end = len(positions) - page * JOURNAL_PAGE_SIZE
+    for i in reversed(positions[max(0, end - JOURNAL_PAGE_SIZE):end]):
+        it = items[i]
+        st.markdown(f"**{it.get('title','')}** — {it.get('time')}")
+        st.write(it.get('note',''))
+        if it.get('media'):
+            journal_media(i, it)
+        st.markdown('---')
+    if pages > 1:
+        cols = st.columns(3)
+        if page > 0 and cols[0].button('Newer entries'):
+            st.session_state.journal_page = page - 1
+            st.rerun()
+        cols[1].caption(f'Page {page + 1} of {pages}')
+        if page < pages - 1 and cols[2].button('Older entries'):
+            st.session_state.journal_page = page + 1
+            st.rerun()
 
 # --------------------------
 # Virtual Memory Map
@@ -725,50 +889,112 @@ with tab[4]:
 MAP_META = Path('map.json')
 
 def load_map():
-    if MAP_META.exists():
-        try:
-            return json.loads(MAP_META.read_text(encoding='utf-8'))
-        except Exception:
-            return []
-    return []
+    return docstore.load(MAP_META, list)
 
 def save_map(items):
-    try:
-        MAP_META.write_text(json.dumps(items, ensure_ascii=False, indent=2), encoding='utf-8')
-    except Exception:
-        pass
+    docstore.save(MAP_META, items)
+
+# Cluster size per detail level, in degrees
+MAP_LEVELS = {'World': 20.0, 'Country': 2.0, 'City': 0.2}
+# Pins listed under the map at a time
+MAP_LIST_LIMIT = 20
+
+@st.cache_resource(max_entries=1)
+def get_map_index(stamp):
+    # stamp (mtime/size of map.json) is only the cache key; pins are keyed by their position
+    index = geo.GridIndex()
+    for i, it in enumerate(load_map()):
+        c = geo.pin_coords(it)
+        if c:
+            index.add(i, *c)
+    return index
+
+def show_pin(i, it, distance=None):
+    st.markdown(f"**{it.get('place')}** — {it.get('time')}" + (f" · {distance:.1f} km" if distance is not None else ''))
+    st.write(it.get('note',''))
+    if it.get('photo') and blobs.resolve(it.get('photo')).exists():
+        show_image(blobs.resolve(it.get('photo')), width=240, key=f'pin_{i}')
+    if it.get('coords'):
+        st.write(f"Coordinates: {it.get('coords')}")
+    st.markdown('---')
 
-with tab[5]:
+def render_map():
     st.markdown("<h2 style='text-align:center;'>Virtual Memory Map</h2>", unsafe_allow_html=True)
     st.write('Pin places you visited together and add a short memory or photo.')
-    place = st.text_input('Place name (city, spot)')
-    coords = st.text_input('Coordinates (lat,lon) — optional')
-    note = st.text_area('Memory / story')
+    place = st.text_input('Place name (city, spot)', key='map_place')
+    coords = st.text_input('Coordinates (lat,lon) — optional', key='map_coords',
+                           help='e.g. 48.85, 2.35 or 40.7 N, 74.0 W')
+    note = st.text_area('Memory / story', key='map_note')
     photo = st.file_uploader('Photo (optional)', type=['png','jpg','jpeg'], key='map_photo')
     if st.button('Add pin'):
         items = load_map()
         fname = None
-        if photo:
-            safe = f"{datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{photo.name}"
-            (Path('map_media') / safe).parent.mkdir(exist_ok=True)
-            (Path('map_media') / safe).write_bytes(photo.read())
-            fname = str(Path('map_media') / safe)
-        items.append({'place': place, 'coords': coords, 'note': note, 'photo': fname, 'time': datetime.datetime.utcnow().isoformat()})
-        save_map(items)
-        st.success('Pin added')
+        try:
+            latlon = geo.parse_coords(coords)
+        except ValueError as e:
+            st.error(f'Coordinates not saved: {e}')
+        else:
+            try:
+                if photo:
+                    fname, _, _ = blobs.save_upload(photo)
+                pin = {'place': place, 'coords': coords, 'note': note, 'photo': fname, 'time': timeline.stamp(items)}
+                if latlon:
+                    pin['lat'], pin['lon'] = latlon
+                items.append(pin)
+                save_map(items)
+                refresh_search_index('map')
+                st.success('Pin added')
+            except Exception as e:
+                st.error(f"Failed to save {photo.name}: {e}")
     st.markdown('---')
     items = load_map()
     if not items:
         st.info('No map pins yet.')
+        return
+    index = get_map_index(file_stamp(MAP_META))
+    if index.cells:
+        # clustered on the server: one dot per occupied cell, however many pins it holds
+        level = st.radio('Detail', list(MAP_LEVELS), horizontal=True, key='map_level')
+        cell_m = MAP_LEVELS[level] * geo.KM_PER_DEG_LAT * 1000
+        clusters = index.clusters(MAP_LEVELS[level])
+        st.map({'lat': [c[0] for c in clusters], 'lon': [c[1] for c in clusters],
+                'size': [cell_m * 0.1 * min(4, 1 + n ** 0.5 / 4) for _, _, n in clusters]},
+               size='size', color=ACCENT)
+        st.caption(f'{sum(c[2] for c in clusters)} pins in {len(clusters)} places')
+
+    find = st.radio('Show', ['Latest pins', 'Near a place', 'In an area'], horizontal=True, key='map_find')
+    if find == 'Near a place':
+        near = st.text_input('Near (lat,lon)', key='map_near')
+        st.session_state.setdefault('map_radius', 50.0)
+        radius = st.number_input('Within (km)', min_value=1.0, step=10.0, key='map_radius')
+        try:
+            center = geo.parse_coords(near)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        if center:
+            hits = index.near(*center, radius, limit=MAP_LIST_LIMIT)
+            if not hits:
+                st.info('No pins there yet.')
+            for d, i in hits:
+                show_pin(i, items[i], d)
+    elif find == 'In an area':
+        area = st.text_input('Area (south,west,north,east)', key='map_area')
+        if area.strip():
+            try:
+                found = index.bbox(*geo.parse_bbox(area))
+            except ValueError as e:
+                st.error(str(e))
+                return
+            if not found:
+                st.info('No pins there yet.')
+            for i in sorted(found, reverse=True)[:MAP_LIST_LIMIT]:
+                show_pin(i, items[i])
+            if len(found) > MAP_LIST_LIMIT:
+                st.caption(f'Showing the {MAP_LIST_LIMIT} newest of {len(found)} pins')
     else:
-        for it in items:
-            st.markdown(f"**{it.get('place')}** — {it.get('time')}")
-            st.write(it.get('note',''))
-            if it.get('photo') and Path(it.get('photo')).exists():
-                st.image(it.get('photo'))
-            if it.get('coords'):
-                st.write(f"Coordinates: {it.get('coords')}")
-            st.markdown('---')
+        for i in range(len(items) - 1, max(-1, len(items) - 1 - MAP_LIST_LIMIT), -1):
+            show_pin(i, items[i])
 
 # --------------------------
 # Love Letters Archive
@@ -776,55 +1002,52 @@ with tab[5]:
 LETTERS_META = Path('letters.json')
 
 def load_letters():
-    if LETTERS_META.exists():
-        try:
-            return json.loads(LETTERS_META.read_text(encoding='utf-8'))
-        except Exception:
-            return []
-    return []
+    return docstore.load(LETTERS_META, list)
 
 def save_letters(items):
-    try:
-        LETTERS_META.write_text(json.dumps(items, ensure_ascii=False, indent=2), encoding='utf-8')
-    except Exception:
-        pass
+    docstore.save(LETTERS_META, items)
 
-with tab[6]:
+@st.cache_resource(max_entries=1)
+def get_letter_schedule(stamp):
+    # stamp (mtime/size of letters.json) is only the cache key: the archive is parsed and
+    # indexed again only after it changes
+    return letter_schedule.LetterSchedule(load_letters())
+
+def current_letter_schedule():
+    return get_letter_schedule(file_stamp(LETTERS_META))
+
+def render_letters():
     st.markdown("<h2 style='text-align:center;'>Love Letters Archive</h2>", unsafe_allow_html=True)
-    st.write('Write letters and choose when they unlock (daily, weekly, specific date).')
-    letter_text = st.text_area('Letter text')
-    unlock = st.selectbox('Unlock schedule', ['immediate','daily','weekly','on date'])
+    st.write('Write letters and choose when they unlock: right away, on a date, or in the daily or weekly rotation (one letter a day / a week).')
+    letter_text = st.text_area('Letter text', key='letter_text')
+    unlock = st.selectbox('Unlock schedule', ['immediate','daily','weekly','on date'], key='letter_unlock')
     unlock_date = None
     if unlock == 'on date':
-        unlock_date = st.date_input('Unlock date')
+        unlock_date = st.date_input('Unlock date', key='letter_date')
     if st.button('Add letter'):
         items = load_letters()
-        items.append({'text': letter_text, 'schedule': unlock, 'date': str(unlock_date) if unlock_date else None, 'time': datetime.datetime.utcnow().isoformat()})
+        items.append({'text': letter_text, 'schedule': unlock, 'date': str(unlock_date) if unlock_date else None, 'time': timeline.stamp(items)})
         save_letters(items)
+        refresh_search_index('letters')
         st.success('Letter saved')
     st.markdown('---')
-    # Show available letters based on schedule (simple logic)
-    items = load_letters()
-    now = datetime.datetime.utcnow()
-    for it in items:
-        show = False
-        if it.get('schedule') == 'immediate':
-            show = True
-        elif it.get('schedule') == 'daily':
-            show = True
-        elif it.get('schedule') == 'weekly':
-            show = True
-        elif it.get('schedule') == 'on date' and it.get('date'):
-            try:
-                d = datetime.date.fromisoformat(it.get('date'))
-                if d <= now.date():
-                    show = True
-            except Exception:
-                pass
-        if show:
-            st.markdown(f"**Letter:** {it.get('time')}")
-            st.write(it.get('text',''))
-            st.markdown('---')
+    # Show the letters unlocked today: a lookup in the precomputed schedule, not a scan
+    schedule = current_letter_schedule()
+    today = datetime.datetime.utcnow().date()
+    visible = schedule.visible(today)
+    for it in visible:
+        st.markdown(f"**Letter:** {it.get('time')}")
+        st.write(it.get('text',''))
+        st.markdown('---')
+    upcoming = schedule.next_unlock(today)
+    if upcoming:
+        st.caption(f'Next letter unlocks on {upcoming:%b %d, %Y}')
+    if visible and st.button('Export letters as PDF'):
+        # download_button needs the whole file as bytes anyway, so build it in memory
+        buffer = io.BytesIO()
+        love_notes.export_letters_pdf(visible, buffer)
+        st.download_button('Download letters (PDF)', data=buffer.getvalue(), file_name='Letters_for_Lina.pdf',
+                           mime='application/pdf')
 
 # --------------------------
 # Countdowns
@@ -832,23 +1055,15 @@ with tab[6]:
 COUNT_META = Path('countdowns.json')
 
 def load_counts():
-    if COUNT_META.exists():
-        try:
-            return json.loads(COUNT_META.read_text(encoding='utf-8'))
-        except Exception:
-            return []
-    return []
+    return docstore.load(COUNT_META, list)
 
 def save_counts(items):
-    try:
-        COUNT_META.write_text(json.dumps(items, ensure_ascii=False, indent=2), encoding='utf-8')
-    except Exception:
-        pass
+    docstore.save(COUNT_META, items)
 
-with tab[7]:
+def render_countdowns():
     st.markdown("<h2 style='text-align:center;'>Countdowns</h2>", unsafe_allow_html=True)
-    name = st.text_input('Event name')
-    date = st.date_input('Date')
+    name = st.text_input('Event name', key='count_name')
+    date = st.date_input('Date', key='count_date')
     if st.button('Add countdown'):
         items = load_counts()
         items.append({'name': name, 'date': str(date)})
@@ -874,20 +1089,12 @@ with tab[7]:
 PRIVATE_META = Path('private.json')
 
 def load_private():
-    if PRIVATE_META.exists():
-        try:
-            return json.loads(PRIVATE_META.read_text(encoding='utf-8'))
-        except Exception:
-            return {}
-    return {}
+    return docstore.load(PRIVATE_META, dict)
 
 def save_private(d):
-    try:
-        PRIVATE_META.write_text(json.dumps(d, ensure_ascii=False, indent=2), encoding='utf-8')
-    except Exception:
-        pass
+    docstore.save(PRIVATE_META, d)
 
-with tab[8]:
+def render_private():
     st.markdown("<h2 style='text-align:center;'>Private Space 🔒</h2>", unsafe_allow_html=True)
     st.write('This area can be password-protected for only you two.')
     # basic password protect (local only)
@@ -913,4 +1120,229 @@ with tab[8]:
             else:
                 st.error('Incorrect password')
 
+# --------------------------
+# Memories timeline
+# --------------------------
+TIMELINE_PAGE_SIZE = 30
+TIMELINE_ICONS = {'message': '💌', 'journal': '📔', 'map': '📍', 'song': '🎵', 'letter': '💝'}
+
+
+def message_timeline():
+    # newest first, fetched a page at a time by id, only as far as the timeline is read
+    before = None
+    while True:
+        batch = load_messages(before_id=before, limit=CHAT_PAGE_SIZE)
+        for m in reversed(batch):
+            yield timeline.time_of(m), 'message', m
+        if len(batch) < CHAT_PAGE_SIZE:
+            return
+        before = batch[0]['id']
+
+
+def timeline_text(kind, it):
+    if kind == 'message':
+        return f"**{it.get('from', '')}**: {it.get('text', '')}"
+    if kind == 'journal':
+        return f"**{it.get('title', '')}** {it.get('note', '')}"
+    if kind == 'map':
+        return f"**{it.get('place', '')}** {it.get('note', '')}"
+    if kind == 'song':
+        return f"**{it.get('orig_name', '')}** uploaded by {it.get('uploader', '')}"
+    return it.get('text', '')
+
+
+def render_timeline():
+    st.markdown("<h2 style='text-align:center;'>Memories</h2>", unsafe_allow_html=True)
+    st.write('Everything you have shared, newest first.')
+    st.session_state.setdefault('timeline_page', 0)
+    today = datetime.datetime.utcnow().date()
+    stream = timeline.merge(
+        message_timeline(),
+        timeline.newest_first('journal', load_journal()),
+        timeline.newest_first('map', load_map()),
+        timeline.newest_first('song', load_songs_meta()),
+        # only letters that are unlocked today
+        timeline.newest_first('letter', current_letter_schedule().visible(today)),
+    )
+    page = st.session_state.timeline_page
+    entries = timeline.page(stream, page, TIMELINE_PAGE_SIZE)
+    if not entries and page == 0:
+        st.info('Nothing here yet.')
+    for t, kind, it in entries[:TIMELINE_PAGE_SIZE]:
+        try:
+            when = datetime.datetime.fromisoformat(t).strftime('%b %d, %Y %H:%M')
+        except Exception:
+            when = t
+        st.markdown(f"{TIMELINE_ICONS[kind]} {when} — {timeline_text(kind, it)}")
+    cols = st.columns(2)
+    if page > 0 and cols[0].button('Newer'):
+        st.session_state.timeline_page -= 1
+        st.rerun()
+    if len(entries) > TIMELINE_PAGE_SIZE and cols[1].button('Older'):
+        st.session_state.timeline_page += 1
+        st.rerun()
+
+# --------------------------
+# Search
+# --------------------------
+SEARCH_DB = Path('search.db')
+SEARCH_PAGE_SIZE = 20
+SEARCH_KINDS = {'All': None, 'Messages': 'messages', 'Journal': 'journal', 'Letters': 'letters', 'Map': 'map'}
+
+
+@st.cache_resource
+def get_search_index():
+    return search_index.SearchIndex(SEARCH_DB)
+
+
+def _journal_doc(i, it):
+    return (i, it.get('title', ''), it.get('note', ''), it.get('time', ''))
+
+def _letter_doc(i, it):
+    return (i, 'Letter', it.get('text', ''), it.get('time', ''))
+
+def _map_doc(i, it):
+    return (i, it.get('place', ''), it.get('note', ''), it.get('time', ''))
+
+SEARCH_LISTS = {
+    'journal': (load_journal, _journal_doc),
+    'letters': (load_letters, _letter_doc),
+    'map': (load_map, _map_doc),
+}
+
+
+def _message_doc(m):
+    return (m['id'], f"{m.get('from', '')} → {m.get('to', '')}", m.get('text', ''), m.get('time', ''))
+
+
+def index_sent_message(entry):
+    # only the message just sent, so Send never waits on a catch-up over the whole
+    # history; if earlier messages aren't indexed yet, the Search page fills them in
+    try:
+        prev = load_messages(before_id=entry['id'], limit=1)
+        start = prev[-1]['id'] + 1 if prev else 0
+        get_search_index().add('messages', [_message_doc(entry)], start, entry['id'] + 1)
+    except Exception:
+        pass
+
+
+def refresh_search_index(*sources):
+    # indexes only what was added since the last call (by message id / list length);
+    # search is a convenience, so a failure here never blocks saving
+    try:
+        idx = get_search_index()
+        for source in sources or ('messages', *SEARCH_LISTS):
+            if source == 'messages':
+                start = idx.position('messages')
+                new = get_message_store(STORAGE).fetch_messages_since(start - 1)
+                if new:
+                    idx.add('messages', [_message_doc(m) for m in new], start, new[-1]['id'] + 1)
+            else:
+                load, to_doc = SEARCH_LISTS[source]
+                idx.add_list(source, load(), to_doc)
+    except Exception:
+        pass
+
+
+def render_search():
+    st.markdown("<h2 style='text-align:center;'>Search 🔎</h2>", unsafe_allow_html=True)
+    query = st.text_input('Search messages, journal, letters and map pins', key='search_query')
+    kind = st.selectbox('In', list(SEARCH_KINDS), key='search_kind')
+    # a new query or filter starts again at the first page
+    if (query, kind) != st.session_state.get('search_last'):
+        st.session_state.search_last = (query, kind)
+        st.session_state.search_page = 0
+    if not query.strip():
+        return
+    refresh_search_index()
+    page = st.session_state.search_page
+    try:
+        # one extra row tells us whether there is a next page
+        hits = get_search_index().search(query, limit=SEARCH_PAGE_SIZE + 1, offset=page * SEARCH_PAGE_SIZE,
+                                         kind=SEARCH_KINDS[kind])
+    except Exception as e:
+        st.error(f'Search failed: {e}')
+        return
+    has_next = len(hits) > SEARCH_PAGE_SIZE
+    hits = hits[:SEARCH_PAGE_SIZE]
+    unlocked = set(current_letter_schedule().visible_indexes(datetime.datetime.utcnow().date()))
+    shown = 0
+    for h in hits:
+        if h['kind'] == 'letters':
+            # letters that haven't unlocked yet stay secret in search too
+            if int(h['ref']) not in unlocked:
+                continue
+        shown += 1
+        st.markdown(f"**{h['title'] or h['kind'].title()}** · {h['kind']} · {h['time']}")
+        st.markdown(h['snippet'])
+        st.markdown('---')
+    if not shown and page == 0:
+        st.info('Nothing found.')
+    cols = st.columns(2)
+    if page > 0 and cols[0].button('Previous results'):
+        st.session_state.search_page -= 1
+        st.rerun()
+    if has_next and cols[1].button('More results'):
+        st.session_state.search_page += 1
+        st.rerun()
+
+# --------------------------
+# Navigation: only the open section's function runs (and reads its files) on a rerun
+# --------------------------
+def media_references(store):
+    # paged, so sends and syncs from other sessions get the store in between; anything
+    # sent during the walk is newer than the GC grace period anyway
+    return blobs.media_references(message_store.iter_messages(store), load_songs_meta(), load_journal(), load_map())
+
+
+@st.cache_resource(max_entries=1)
+def schedule_media_gc(day):
+    # day is only the cache key: one pass per process per day, off the script thread
+    store = get_message_store(STORAGE)
+    threading.Thread(target=lambda: blobs.gc(media_references(store)), name='media-gc', daemon=True).start()
+    return True
+
+
+def show_metrics(page_title):
+    run = metrics.finish()
+    if run is None:
+        return
+    run['label'] = page_title
+    metrics.append_jsonl(METRICS_FILE, run, METRICS_FILE_MB * 1024 * 1024)
+    with st.sidebar:
+        st.markdown('### Rerun metrics')
+        st.metric('Script run', f"{run['total_ms']:.1f} ms")
+        if run['sections_ms']:
+            st.dataframe({'section': list(run['sections_ms']), 'ms': list(run['sections_ms'].values())},
+                         hide_index=True)
+        if run['counters']:
+            st.dataframe({'counter': list(run['counters']), 'value': list(run['counters'].values())},
+                         hide_index=True)
+        st.caption(f'Also appended to {METRICS_FILE}')
+
+
+SECTIONS = [
+    st.Page(render_home, title='Home', url_path='home', default=True),
+    st.Page(render_play, title='Play', url_path='play'),
+    st.Page(render_messages, title='Messages', url_path='messages'),
+    st.Page(render_songs, title='Songs', url_path='songs'),
+    st.Page(render_journal, title='Journal', url_path='journal'),
+    st.Page(render_map, title='Map', url_path='map'),
+    st.Page(render_letters, title='Letters', url_path='letters'),
+    st.Page(render_countdowns, title='Countdowns', url_path='countdowns'),
+    st.Page(render_timeline, title='Memories', url_path='memories'),
+    st.Page(render_search, title='Search', url_path='search'),
+    st.Page(render_private, title='Private', url_path='private'),
+]
+schedule_media_gc(datetime.date.today().isoformat())
+page = st.navigation(SECTIONS, position='top')
+try:
+    with metrics.section(f'page: {page.title}'):
+        page.run()
+    if DEBUG_METRICS:
+        show_metrics(page.title)
+finally:
+    # a run cut short (st.rerun, an error) must not leave its collector to the next rerun
+    metrics.finish()
+
 # End
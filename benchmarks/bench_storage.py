@@ -0,0 +1,272 @@
+"""Benchmark the message storage backends as the history grows.
+
+For each history size, a synthetic history (with replies, reactions and
+image attachments) is written straight into a fresh ``file`` store and a
+fresh ``sqlite`` store. Then every store operation the Messages tab uses is
+timed. The results give latency percentiles per operation and the peak
+Python memory one call allocates (tracemalloc). They are printed as a table
+and written to a JSON file, so two revisions can be compared.
+
+    python benchmarks/bench_storage.py                        # 1k and 100k messages
+    python benchmarks/bench_storage.py --sizes 1000,100000,1000000 --out before.json
+"""
+import argparse
+import datetime
+import json
+import math
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import message_store  # noqa: E402
+
+PAGE = 50
+PEOPLE = ('Youssef', 'Lina')
+EMOJIS = ('❤️', '😘', '😂', '😍', '👍')
+WORDS = ('love', 'you', 'miss', 'today', 'dinner', 'later', 'cute', 'sunshine', 'call', 'me', 'tonight', 'always')
+
+
+def synthetic_history(n, seed=0, unread=100):
+    """Yield ``n`` messages with ids 1..n. About 10% have replies, 20% reactions and 5% images.
+
+    The last ``unread`` messages are unread.
+    """
+    rnd = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1)
+    reply_id = n
+    for i in range(1, n + 1):
+        sender = PEOPLE[i % 2]
+        msg = {
+            'id': i,
+            'from': sender,
+            'to': PEOPLE[(i + 1) % 2],
+            'text': ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 20))),
+            'time': (start + datetime.timedelta(minutes=7 * i)).isoformat(),
+            'read': i <= n - unread,
+            'images': [f'{i}_photo.jpg'] if rnd.random() < 0.05 else [],
+        }
+        if rnd.random() < 0.10:
+            msg['replies'] = []
+            for _ in range(rnd.randint(1, 3)):
+                reply_id += 1
+                msg['replies'].append({'id': reply_id, 'from': msg['to'], 'to': sender, 'text': rnd.choice(WORDS),
+                                       'time': msg['time']})
+        if rnd.random() < 0.20:
+            msg['reactions'] = {e: rnd.randint(1, 3) for e in rnd.sample(EMOJIS, rnd.randint(1, 2))}
+        yield msg
+
+
+def seed_file(path, messages):
+    # the snapshot format FileMessageStore reads, written one message at a time
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"seq":0,"messages":[')
+        for i, m in enumerate(messages):
+            if i:
+                f.write(',')
+            f.write(json.dumps(m, ensure_ascii=False, separators=(',', ':')))
+        f.write(']}')
+
+
+def seed_sqlite(path, messages, batch=10000):
+    store = message_store.SqliteMessageStore(path)
+    msgs, replies, reactions = [], [], []
+
+    def flush(conn):
+        conn.executemany("INSERT INTO messages (id, sender, recipient, text, time, read, images) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", msgs)
+        conn.executemany("INSERT INTO replies (id, parent_id, sender, recipient, text, time) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", replies)
+        conn.executemany("INSERT INTO reactions (message_id, emoji, count) VALUES (?, ?, ?)", reactions)
+        msgs.clear()
+        replies.clear()
+        reactions.clear()
+
+    with store.transaction() as conn:
+        for m in messages:
+            msgs.append((m['id'], m['from'], m['to'], m['text'], m['time'], int(m['read']),
+                         json.dumps(m['images'], ensure_ascii=False)))
+            replies.extend((r['id'], m['id'], r['from'], r['to'], r['text'], r['time']) for r in m.get('replies', ()))
+            reactions.extend((m['id'], e, c) for e, c in m.get('reactions', {}).items())
+            if len(msgs) >= batch:
+                flush(conn)
+        flush(conn)
+        # same backfill the unread_counts migration runs
+        conn.execute("DELETE FROM unread_counts")
+        conn.execute(message_store.MIGRATIONS[1][1])
+    store.close()
+
+
+def open_store(backend, workdir):
+    if backend == 'sqlite':
+        return message_store.SqliteMessageStore(workdir / 'messages.db')
+    return message_store.FileMessageStore(workdir / 'messages.json')
+
+
+def close_store(store):
+    if hasattr(store, 'close'):
+        store.close()
+
+
+def new_message(i):
+    return {'from': 'Lina', 'to': 'Youssef', 'text': f'benchmark message {i}',
+            'time': datetime.datetime.utcnow().isoformat(), 'read': False, 'images': []}
+
+
+def operations(store, n, rnd):
+    """(name, setup, call) for every timed operation; ``setup`` runs untimed before each call."""
+    def random_id():
+        return rnd.randint(1, n)
+
+    def none():
+        return None
+
+    def unread_message():
+        store.add_message(new_message(0))
+
+    reply = {'from': 'Youssef', 'to': 'Lina', 'text': 'reply', 'time': '2024-01-01T00:00:00'}
+    return [
+        ('load_messages latest page', none, lambda _: store.load_messages(limit=PAGE)),
+        ('load_messages random page', random_id, lambda i: store.load_messages(before_id=i, limit=PAGE)),
+        ('fetch_messages_since (nothing new)', none, lambda _: store.fetch_messages_since(n + 10 ** 9)),
+        ('get_message', random_id, lambda i: store.get_message(i)),
+        ('count_unread', none, lambda _: store.count_unread('Youssef')),
+        ('change_token', none, lambda _: store.change_token()),
+        ('add_message', none, lambda _: store.add_message(new_message(1))),
+        ('add_reply', random_id, lambda i: store.add_reply(i, dict(reply))),
+        ('add_reaction', random_id, lambda i: store.add_reaction(i, '❤️', 'Youssef')),
+        # one new unread message before each call, so there is always something to mark
+        ('mark_all_read', unread_message, lambda _: store.mark_all_read('Youssef')),
+    ]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # nearest rank
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(samples_ns):
+    ms = sorted(s / 1e6 for s in samples_ns)
+    return {
+        'n': len(ms),
+        'mean_ms': round(sum(ms) / len(ms), 4),
+        'p50_ms': round(percentile(ms, 50), 4),
+        'p90_ms': round(percentile(ms, 90), 4),
+        'p99_ms': round(percentile(ms, 99), 4),
+        'max_ms': round(ms[-1], 4),
+    }
+
+
+def peak_kib(setup, call):
+    arg = setup()
+    tracemalloc.start()
+    try:
+        call(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def bench_backend(backend, size, workdir, iterations, cold_runs, seed):
+    results = []
+    rnd = random.Random(seed)
+
+    # cold start: a new store object (as after a restart) serving its first page
+    def cold_open(_):
+        store = open_store(backend, workdir)
+        store.load_messages(limit=PAGE)
+        close_store(store)
+
+    samples = []
+    for _ in range(cold_runs):
+        t0 = time.perf_counter_ns()
+        cold_open(None)
+        samples.append(time.perf_counter_ns() - t0)
+    peak = peak_kib(lambda: None, cold_open)
+    results.append(dict(op='open + first page', **summarize(samples), peak_kib=peak))
+
+    store = open_store(backend, workdir)
+    store.load_messages(limit=PAGE)
+    try:
+        for name, setup, call in operations(store, size, rnd):
+            samples = []
+            for _ in range(iterations):
+                arg = setup()
+                t0 = time.perf_counter_ns()
+                call(arg)
+                samples.append(time.perf_counter_ns() - t0)
+            results.append(dict(op=name, **summarize(samples), peak_kib=peak_kib(setup, call)))
+    finally:
+        close_store(store)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000', help='comma-separated history sizes (default: %(default)s)')
+    parser.add_argument('--backends', default='file,sqlite', help='default: %(default)s')
+    parser.add_argument('--iterations', type=int, default=200, help='timed calls per operation (default: %(default)s)')
+    parser.add_argument('--cold-runs', type=int, default=3, help='store re-opens timed per size (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='where to build the histories (default: a temp dir, removed afterwards)')
+    parser.add_argument('--out', default='bench_results.json', help='JSON results file (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'time': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'results': [],
+    }
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        for size in sizes:
+            for backend in backends:
+                workdir = Path(tmp) / f'{backend}-{size}'
+                workdir.mkdir()
+                t0 = time.perf_counter()
+                history = synthetic_history(size, seed=args.seed)
+                if backend == 'sqlite':
+                    seed_sqlite(workdir / 'messages.db', history)
+                else:
+                    seed_file(workdir / 'messages.json', history)
+                print(f'{backend} {size}: seeded in {time.perf_counter() - t0:.1f}s', file=sys.stderr)
+                for r in bench_backend(backend, size, workdir, args.iterations, args.cold_runs, args.seed):
+                    report['results'].append(dict(backend=backend, size=size, **r))
+    Path(args.out).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    print(f"{'backend':8} {'size':>8}  {'operation':36} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'peak KiB':>9}")
+    for r in report['results']:
+        print(f"{r['backend']:8} {r['size']:>8}  {r['op']:36} {r['p50_ms']:>9.3f} {r['p90_ms']:>9.3f} "
+              f"{r['p99_ms']:>9.3f} {r['peak_kib']:>9}")
+    print(f'results written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Content-addressed storage for uploaded media.
+
+Every upload (song, chat image, journal photo or video, map photo) is
+stored once, as ``blobs/<first two hex digits>/<sha256><ext>``. The
+metadata files refer to it by that relative path. Uploading the same file
+twice reuses the existing blob. Nothing deletes a blob directly: ``gc``
+counts the references held by the metadata and removes the blobs nobody
+refers to any more. Blobs changed within the grace period are kept, so an
+upload whose metadata hasn't been saved yet is never collected.
+
+Files uploaded before the blob store existed stay where they are;
+``resolve`` maps their old names (``songs/`` keys, ``message_media/``
+names, ``journal/...`` paths) to their location.
+
+    python blobs.py gc          # reclaim unreferenced blobs now
+"""
+import os
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+import uploads
+
+BLOB_DIR = Path('blobs')
+INCOMING = BLOB_DIR / 'incoming'
+# how long a blob (or a half-finished upload) survives without a reference
+GC_GRACE_SECONDS = 3600
+
+
+def path_for(sha256, suffix=''):
+    return BLOB_DIR / sha256[:2] / f'{sha256}{suffix.lower()}'
+
+
+def put(src, suffix=''):
+    """Store the file object ``src``; returns ``(ref, sha256, size)``."""
+    tmp = INCOMING / uuid.uuid4().hex
+    sha256, size = uploads.copy_stream(src, tmp)
+    dest = path_for(sha256, suffix)
+    try:
+        if dest.exists():
+            # already stored; touching it restarts the GC grace period
+            os.utime(dest)
+            tmp.unlink()
+        else:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, dest)
+    except BaseException:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        raise
+    return dest.as_posix(), sha256, size
+
+
+def save_upload(f):
+    """Store a Streamlit UploadedFile; returns ``(ref, sha256, size)``."""
+    f.seek(0)
+    return put(f, Path(f.name).suffix)
+
+
+def is_blob(ref):
+    return bool(ref) and str(ref).startswith(BLOB_DIR.as_posix() + '/')
+
+
+def resolve(ref, legacy_dir=None):
+    """Path of a stored file. Bare names from before the blob store are looked up in ``legacy_dir``."""
+    ref = str(ref)
+    if legacy_dir is not None and '/' not in ref:
+        return Path(legacy_dir) / ref
+    return Path(ref)
+
+
+def media_references(messages=(), songs=None, journal=(), pins=()):
+    """Every media reference held by the app's metadata (legacy paths included)."""
+    for m in messages:
+        yield from m.get('images') or ()
+    for info in (songs or {}).values():
+        yield info.get('blob')
+    for it in journal:
+        yield it.get('media')
+    for it in pins:
+        yield it.get('photo')
+
+
+def refcounts(refs):
+    return Counter(r for r in refs if is_blob(r))
+
+
+def gc(refs, grace=GC_GRACE_SECONDS):
+    """Delete blobs with no references; returns ``(files removed, bytes freed)``."""
+    counts = refcounts(refs)
+    cutoff = time.time() - grace
+    removed = freed = 0
+    if not BLOB_DIR.exists():
+        return removed, freed
+    for shard in BLOB_DIR.iterdir():
+        if not shard.is_dir():
+            continue
+        for p in shard.iterdir():
+            # uploads that never finished are collected the same way
+            if shard != INCOMING and counts[p.as_posix()]:
+                continue
+            try:
+                st = p.stat()
+                if st.st_mtime > cutoff:
+                    continue
+                p.unlink()
+            except OSError:
+                continue
+            removed += 1
+            freed += st.st_size
+    return removed, freed
+
+
+if __name__ == '__main__':
+    import argparse
+
+    import docstore
+    import message_store
+
+    parser = argparse.ArgumentParser(description='Remove media blobs no longer referenced by the app.')
+    parser.add_argument('command', choices=['gc'])
+    parser.add_argument('--grace', type=int, default=GC_GRACE_SECONDS,
+                        help='keep blobs changed in the last N seconds (default: %(default)s)')
+    args = parser.parse_args()
+    store = message_store.open_store(os.getenv('MESSAGE_STORAGE', 'file').lower())
+    refs = media_references(message_store.iter_messages(store), docstore.load('songs.json', dict),
+                            docstore.load('journal.json', list), docstore.load('map.json', list))
+    removed, freed = gc(refs, grace=args.grace)
+    print(f'removed {removed} blob(s), {freed / 1024 / 1024:.1f} MiB')
@@ -0,0 +1,77 @@
+"""Cached, atomically written JSON documents (songs.json, journal.json, ...).
+
+``load`` parses a file only when its mtime or size changed since the last
+parse in this process; otherwise it returns the already-parsed object. That
+object is shared, so callers should only mutate it on the way to ``save``.
+``save`` writes compact JSON to a temp file and renames it over the
+original, so readers never see a half-written document.
+"""
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+import metrics
+
+_lock = threading.Lock()
+# str(path) -> ((mtime_ns, size), parsed value)
+_cache = {}
+
+
+def _stat(path):
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def load(path, default=dict):
+    """Parsed contents of ``path``, or ``default()`` if it is missing or unreadable."""
+    path = Path(path)
+    key = _stat(path)
+    if key is None:
+        return default()
+    entry = _cache.get(str(path))
+    if entry is not None and entry[0] == key:
+        return entry[1]
+    try:
+        raw = path.read_bytes()
+        metrics.count('file_reads')
+        metrics.count('bytes_read', len(raw))
+        value = json.loads(raw)
+        metrics.count('json_parses')
+    except Exception:
+        return default()
+    with _lock:
+        _cache[str(path)] = (key, value)
+    return value
+
+
+def save(path, value):
+    path = Path(path)
+    try:
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False, separators=(',', ':'))
+                metrics.count('bytes_written', f.tell())
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        with _lock:
+            _cache[str(path)] = (_stat(path), value)
+    except Exception:
+        # the cached copy may have been mutated in place; make the next load re-read the file
+        with _lock:
+            _cache.pop(str(path), None)
+
+
+def invalidate(path=None):
+    with _lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(str(Path(path)), None)
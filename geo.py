@@ -0,0 +1,171 @@
+"""Coordinates, a grid spatial index and clustering for the memory map.
+
+Pins are bucketed into cells of ``cell_deg`` degrees. A bounding-box query
+only looks at the cells that overlap the box. A "near here" query turns its
+radius into a box first, then filters by great-circle distance. Clusters are
+built from the cells, not from the individual pins, so the map draws one
+dot per occupied area however many pins it holds.
+"""
+import math
+import re
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = 111.32
+
+# a number, optionally followed by a degree sign and a hemisphere letter
+_NUMBER = re.compile(r'([-+]?)(\d+(?:\.\d*)?|\.\d+)\s*°?\s*(?:([NSEWnsew])(?![^\W\d_]))?')
+_LEFTOVER = re.compile(r'[\w.+-]')
+# the hemisphere letters each axis accepts; the second one makes the number negative
+_HEMISPHERES = {'lat': 'NS', 'lon': 'EW'}
+
+
+def _numbers(text, axes):
+    """One number per entry of ``axes`` ('lat' or 'lon'), signed by any hemisphere letter after it."""
+    found = _NUMBER.findall(text)
+    # a letter, digit, dot or sign left over means part of the text wasn't understood
+    if _LEFTOVER.search(_NUMBER.sub(' ', text)):
+        raise ValueError(f'could not read the numbers in {text!r}')
+    if len(found) != len(axes):
+        return None
+    values = []
+    for (sign, digits, hemisphere), axis in zip(found, axes):
+        value = float(digits)
+        if hemisphere:
+            hemisphere = hemisphere.upper()
+            if sign or hemisphere not in _HEMISPHERES[axis]:
+                raise ValueError(f'{sign}{digits} {hemisphere} is not a valid '
+                                 f'{"latitude" if axis == "lat" else "longitude"}')
+            if hemisphere == _HEMISPHERES[axis][1]:
+                value = -value
+        elif sign == '-':
+            value = -value
+        values.append(value)
+    return values
+
+
+def _check(lat, lon):
+    if not -90 <= lat <= 90:
+        raise ValueError(f'latitude {lat} is outside -90..90')
+    if not -180 <= lon <= 180:
+        raise ValueError(f'longitude {lon} is outside -180..180')
+
+
+def parse_coords(text):
+    """``(lat, lon)`` from text like ``"48.85, 2.35"`` or ``"40.7 N, 74.0 W"``, None if empty; ValueError if it isn't valid."""
+    text = (text or '').strip()
+    if not text:
+        return None
+    numbers = _numbers(text, ('lat', 'lon'))
+    if numbers is None:
+        raise ValueError('expected two numbers: latitude, longitude')
+    lat, lon = numbers
+    _check(lat, lon)
+    return lat, lon
+
+
+def parse_bbox(text):
+    """``(south, west, north, east)`` from four comma-separated numbers; ValueError if it isn't valid."""
+    numbers = _numbers(text or '', ('lat', 'lon', 'lat', 'lon'))
+    if numbers is None:
+        raise ValueError('expected four numbers: south, west, north, east')
+    south, west, north, east = numbers
+    _check(south, west)
+    _check(north, east)
+    if south > north:
+        raise ValueError('the south edge must not be north of the north edge')
+    return south, west, north, east
+
+
+def pin_coords(pin):
+    """Stored ``(lat, lon)`` of a pin; older pins only have the text they were entered with."""
+    if pin.get('lat') is not None and pin.get('lon') is not None:
+        return pin['lat'], pin['lon']
+    try:
+        return parse_coords(pin.get('coords'))
+    except ValueError:
+        return None
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+class GridIndex:
+    def __init__(self, cell_deg=0.1):
+        self.cell_deg = cell_deg
+        self.rows = int(math.ceil(180 / cell_deg))
+        self.cols = int(math.ceil(360 / cell_deg))
+        # (row, col) -> [(key, lat, lon), ...]
+        self.cells = {}
+        # (row, col) -> [lat sum, lon sum, count], kept for clustering
+        self.sums = {}
+
+    def _cell(self, lat, lon):
+        row = min(self.rows - 1, int((lat + 90) // self.cell_deg))
+        col = min(self.cols - 1, int((lon + 180) // self.cell_deg))
+        return row, col
+
+    def add(self, key, lat, lon):
+        cell = self._cell(lat, lon)
+        self.cells.setdefault(cell, []).append((key, lat, lon))
+        acc = self.sums.setdefault(cell, [0.0, 0.0, 0])
+        acc[0] += lat
+        acc[1] += lon
+        acc[2] += 1
+
+    def _cells_in(self, south, west, north, east):
+        """Occupied cells overlapping the box (``west <= east``)."""
+        r0, c0 = self._cell(max(-90.0, south), max(-180.0, west))
+        r1, c1 = self._cell(min(90.0, north), min(180.0, east))
+        if (r1 - r0 + 1) * (c1 - c0 + 1) > len(self.cells):
+            # a box larger than the occupied area: walking the occupied cells is cheaper
+            return [rc for rc in self.cells if r0 <= rc[0] <= r1 and c0 <= rc[1] <= c1]
+        return [(r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1) if (r, c) in self.cells]
+
+    def bbox(self, south, west, north, east):
+        """Keys of the pins inside the box. ``west > east`` means the box crosses the antimeridian."""
+        if west > east:
+            return self.bbox(south, west, north, 180) + self.bbox(south, -180, north, east)
+        found = []
+        for rc in self._cells_in(south, west, north, east):
+            found.extend(k for k, lat, lon in self.cells[rc] if south <= lat <= north and west <= lon <= east)
+        return found
+
+    def near(self, lat, lon, radius_km, limit=None):
+        """``(distance_km, key)`` of the pins within ``radius_km``, nearest first."""
+        dlat = radius_km / KM_PER_DEG_LAT
+        south, north = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+        cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+        if south == -90 or north == 90 or cos_lat < 1e-6 or radius_km / (KM_PER_DEG_LAT * cos_lat) >= 180:
+            # the circle reaches a pole or wraps around: every longitude is in range
+            west, east = -180.0, 180.0
+        else:
+            dlon = radius_km / (KM_PER_DEG_LAT * cos_lat)
+            west = (lon - dlon + 540) % 360 - 180
+            east = (lon + dlon + 540) % 360 - 180
+        boxes = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+        by_key = {}
+        for w, e in boxes:
+            for rc in self._cells_in(south, w, north, e):
+                for k, plat, plon in self.cells[rc]:
+                    by_key[k] = (plat, plon)
+        hits = sorted((haversine_km(lat, lon, plat, plon), k) for k, (plat, plon) in by_key.items())
+        hits = [h for h in hits if h[0] <= radius_km]
+        return hits[:limit] if limit else hits
+
+    def clusters(self, cell_deg):
+        """``(lat, lon, count)`` per occupied cell of ``cell_deg`` degrees (at least the index's own cells).
+
+        Each position is the mean of the pins in the cluster.
+        """
+        factor = max(1, int(round(cell_deg / self.cell_deg)))
+        sums = {}
+        for (r, c), (la, lo, n) in self.sums.items():
+            acc = sums.setdefault((r // factor, c // factor), [0.0, 0.0, 0])
+            acc[0] += la
+            acc[1] += lo
+            acc[2] += n
+        return [(la / n, lo / n, n) for la, lo, n in sums.values()]
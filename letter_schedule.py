@@ -0,0 +1,85 @@
+"""When each letter in the Letters archive is visible.
+
+Schedules:
+
+- ``immediate``: always visible.
+- ``on date``: visible from its date on.
+- ``daily``: the daily letters take turns, one per day.
+- ``weekly``: the weekly letters take turns, one per week (Monday to Sunday).
+
+``LetterSchedule`` parses the archive once. Dated letters are kept sorted by
+unlock date, so the letters visible on a given day are a bisected prefix,
+and the next unlock is the entry right after it. The visible set only
+changes at a boundary (a letter's date, midnight for the daily rotation,
+Monday for the weekly one). The result is kept until the next boundary is
+reached.
+"""
+import bisect
+import datetime
+
+
+def _week(day):
+    # date.toordinal() is 1 for Monday 0001-01-01, so this counts Monday-based weeks
+    return (day.toordinal() - 1) // 7
+
+
+class LetterSchedule:
+    def __init__(self, letters):
+        self.letters = letters
+        self.always = []
+        self.daily = []
+        self.weekly = []
+        dated = []
+        for i, it in enumerate(letters):
+            schedule = it.get('schedule')
+            if schedule == 'immediate':
+                self.always.append(i)
+            elif schedule == 'daily':
+                self.daily.append(i)
+            elif schedule == 'weekly':
+                self.weekly.append(i)
+            elif schedule == 'on date':
+                try:
+                    dated.append((datetime.date.fromisoformat(it.get('date')), i))
+                except Exception:
+                    # unparseable dates never unlock, as before
+                    pass
+        dated.sort()
+        self.dates = [d for d, _ in dated]
+        self.dated = [i for _, i in dated]
+        # (first day, first day it is no longer valid or None, visible indexes)
+        self._cached = None
+
+    def next_unlock(self, today):
+        """First day after ``today`` on which the visible letters change, or None if they never will."""
+        candidates = []
+        k = bisect.bisect_right(self.dates, today)
+        if k < len(self.dates):
+            candidates.append(self.dates[k])
+        if len(self.daily) > 1:
+            candidates.append(today + datetime.timedelta(days=1))
+        if len(self.weekly) > 1:
+            candidates.append(today + datetime.timedelta(days=7 - today.weekday()))
+        return min(candidates) if candidates else None
+
+    def _compute(self, today):
+        shown = list(self.always)
+        shown += self.dated[:bisect.bisect_right(self.dates, today)]
+        if self.daily:
+            shown.append(self.daily[today.toordinal() % len(self.daily)])
+        if self.weekly:
+            shown.append(self.weekly[_week(today) % len(self.weekly)])
+        shown.sort()
+        return shown
+
+    def visible_indexes(self, today):
+        """Indexes into the archive of the letters visible on ``today``, in archive order."""
+        cached = self._cached
+        if cached is not None and cached[0] <= today and (cached[1] is None or today < cached[1]):
+            return cached[2]
+        shown = self._compute(today)
+        self._cached = (today, self.next_unlock(today), shown)
+        return shown
+
+    def visible(self, today):
+        return [self.letters[i] for i in self.visible_indexes(today)]
@@ -0,0 +1,159 @@
+"""PDF rendering for the printable love note and the Letters archive.
+
+Kept free of Streamlit so it can be used (and timed) from a plain Python
+process::
+
+    python love_notes.py letters.json letters.pdf
+"""
+import hashlib
+import io
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfgen import canvas
+
+TEMPLATES = {
+    'classic': {'border': (0.85, 0.18, 0.35), 'title': 'For Lina', 'title_color': (0.82, 0.11, 0.35),
+                'font': 'Times-Roman', 'size': 14, 'color': (0.3, 0, 0.05)},
+    'letter': {'border': (0.85, 0.18, 0.35), 'title': 'A letter for Lina', 'title_color': (0.82, 0.11, 0.35),
+               'font': 'Times-Roman', 'size': 13, 'color': (0.3, 0, 0.05)},
+}
+
+PDF_CACHE_SIZE = 32
+
+
+def _draw_frame(c, template, title=None):
+    width, height = A4
+    # Draw a soft red border
+    c.setStrokeColorRGB(*template['border'])
+    c.setLineWidth(4)
+    margin = 15 * mm
+    c.rect(margin, margin, width - 2*margin, height - 2*margin)
+
+    # Title
+    c.setFont('Helvetica-Bold', 28)
+    c.setFillColorRGB(*template['title_color'])
+    c.drawCentredString(width/2, height - 50*mm, title or template['title'])
+
+
+def draw_note(c, message, sender, template='classic'):
+    """Draw one love note page on an open canvas."""
+    t = TEMPLATES[template]
+    width, height = A4
+    _draw_frame(c, t)
+
+    # Message
+    textobject = c.beginText()
+    textobject.setTextOrigin(30*mm, height - 80*mm)
+    textobject.setFont(t['font'], t['size'])
+    textobject.setFillColorRGB(*t['color'])
+    for line in message.split('\n'):
+        textobject.textLine(line)
+    c.drawText(textobject)
+
+    # Sender
+    c.setFont('Times-Italic', 12)
+    c.drawRightString(width - 30*mm, 30*mm, sender)
+    c.showPage()
+
+
+class _PdfCache:
+    # small LRU of rendered PDFs keyed by a digest of the inputs
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._items[key] = data
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_cache = _PdfCache(PDF_CACHE_SIZE)
+
+
+def note_key(message, sender, template='classic'):
+    return hashlib.sha256(json.dumps([message, sender, template]).encode('utf-8')).hexdigest()
+
+
+def render_note_pdf(message, sender, template='classic'):
+    """PDF bytes for a single love note; identical inputs are served from the cache."""
+    key = note_key(message, sender, template)
+    data = _cache.get(key)
+    if data is None:
+        buffer = io.BytesIO()
+        c = canvas.Canvas(buffer, pagesize=A4)
+        draw_note(c, message, sender, template)
+        c.save()
+        data = buffer.getvalue()
+        _cache.put(key, data)
+    return data
+
+
+def _draw_letter(c, letter, template):
+    t = TEMPLATES[template]
+    width, height = A4
+    lines = []
+    for para in (letter.get('text') or '').split('\n'):
+        lines.extend(simpleSplit(para, t['font'], t['size'], width - 60*mm) or [''])
+    top, bottom = height - 80*mm, 40*mm
+    per_page = max(1, int((top - bottom) // (t['size'] * 1.2)))
+    # long letters continue on extra pages with the same frame
+    for start in range(0, max(len(lines), 1), per_page):
+        _draw_frame(c, t)
+        textobject = c.beginText()
+        textobject.setTextOrigin(30*mm, top)
+        textobject.setFont(t['font'], t['size'])
+        textobject.setFillColorRGB(*t['color'])
+        for line in lines[start:start + per_page]:
+            textobject.textLine(line)
+        c.drawText(textobject)
+        c.setFont('Times-Italic', 11)
+        c.drawRightString(width - 30*mm, 30*mm, (letter.get('time') or '')[:10])
+        c.showPage()
+
+
+def export_letters_pdf(letters, out, template='letter'):
+    """Write every letter in ``letters`` (any iterable) to ``out`` as one multi-page PDF.
+
+    ``out`` is a path or a binary file object. Pages are compressed as they are
+    finished, but reportlab keeps all of them until ``save()``, so memory still
+    grows with the number of pages. Returns the number of letters written.
+    """
+    c = canvas.Canvas(out, pagesize=A4, pageCompression=1)
+    n = 0
+    for letter in letters:
+        _draw_letter(c, letter, template)
+        n += 1
+    if not n:
+        _draw_frame(c, TEMPLATES[template])
+        c.showPage()
+    c.save()
+    return n
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: python love_notes.py letters.json out.pdf')
+    with open(sys.argv[1], encoding='utf-8') as f:
+        count = export_letters_pdf(json.load(f), sys.argv[2])
+    print(f"wrote {count} letter(s) to {sys.argv[2]}")
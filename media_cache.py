@@ -0,0 +1,118 @@
+"""Downscaled copies of uploaded images.
+
+``thumbnail(path, width)`` returns a WebP (or JPEG when Pillow lacks WebP)
+no wider than ``width`` pixels. Derivatives are keyed by a hash of the
+original's content, so a re-uploaded or renamed photo reuses the same file.
+The cache directory is trimmed least-recently-used first once it grows past
+``THUMB_CACHE_MB``.
+"""
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from PIL import Image, ImageOps, features
+
+import metrics
+
+CACHE_DIR = Path(os.getenv('THUMB_CACHE_DIR', '.thumbs'))
+MAX_CACHE_BYTES = int(os.getenv('THUMB_CACHE_MB', '256')) * 1024 * 1024
+FORMAT = 'webp' if features.check('webp') else 'jpeg'
+EXT = '.webp' if FORMAT == 'webp' else '.jpg'
+
+_lock = threading.Lock()
+# (path, mtime_ns, size) -> sha256, so unchanged files are hashed once per process
+_hashes = {}
+_cache_bytes = None
+
+
+def content_hash(path):
+    path = Path(path)
+    st = path.stat()
+    key = (str(path), st.st_mtime_ns, st.st_size)
+    h = _hashes.get(key)
+    if h is None:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        metrics.count('file_reads')
+        metrics.count('bytes_read', st.st_size)
+        h = _hashes[key] = digest.hexdigest()
+    return h
+
+
+def _cache_size():
+    global _cache_bytes
+    if _cache_bytes is None:
+        _cache_bytes = sum(p.stat().st_size for p in CACHE_DIR.rglob('*' + EXT)) if CACHE_DIR.exists() else 0
+    return _cache_bytes
+
+
+def _evict(keep=None):
+    # least recently used first; hits bump mtime, see thumbnail()
+    global _cache_bytes
+    files = []
+    for p in CACHE_DIR.rglob('*' + EXT):
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, p))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    target = MAX_CACHE_BYTES * 9 // 10
+    for _, size, p in files:
+        if total <= target:
+            break
+        if p == keep:
+            continue
+        try:
+            p.unlink()
+            total -= size
+        except OSError:
+            pass
+    _cache_bytes = total
+
+
+def _render(src, dest, width):
+    with Image.open(src) as im:
+        if getattr(im, 'is_animated', False):
+            # keep animated GIFs as they are
+            return False
+        im.draft('RGB', (width, width * 4))
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((width, width * 4))
+        if FORMAT == 'jpeg' and im.mode not in ('RGB', 'L'):
+            im = im.convert('RGB')
+        elif im.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            im = im.convert('RGBA')
+        tmp = dest.with_name(dest.name + '.tmp')
+        im.save(tmp, FORMAT, quality=80)
+    os.replace(tmp, dest)
+    return True
+
+
+def thumbnail(path, width):
+    """Path of a cached copy of ``path`` at most ``width`` px wide, or None if it can't be made."""
+    global _cache_bytes
+    try:
+        h = content_hash(path)
+        dest = CACHE_DIR / h[:2] / f"{h}_{width}{EXT}"
+        if dest.exists():
+            os.utime(dest)
+            return dest
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if not _render(path, dest, width):
+            return None
+        metrics.count('thumbnails_rendered')
+        with _lock:
+            if _cache_bytes is None:
+                _cache_size()
+            else:
+                _cache_bytes += dest.stat().st_size
+            if _cache_bytes > MAX_CACHE_BYTES:
+                _evict(keep=dest)
+        return dest
+    except Exception:
+        return None
@@ -0,0 +1,45 @@
+"""Duration of uploaded recordings, read once when they are saved.
+
+WAV files are read with the standard ``wave`` module, everything else
+(mp3, m4a, ogg, mp4) with ``mutagen``.
+"""
+import wave
+from pathlib import Path
+
+import mutagen
+
+
+def duration_seconds(path):
+    """Length of the recording at ``path`` in seconds, or None if it can't be read."""
+    path = Path(path)
+    try:
+        if path.suffix.lower() == '.wav':
+            with wave.open(str(path), 'rb') as w:
+                rate = w.getframerate()
+                return round(w.getnframes() / rate, 2) if rate else None
+        f = mutagen.File(str(path))
+        length = getattr(getattr(f, 'info', None), 'length', None)
+        if length:
+            return round(float(length), 2)
+    except Exception:
+        pass
+    return None
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return ''
+    seconds = int(round(seconds))
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    return f'{h}:{m:02d}:{s:02d}' if h else f'{m}:{s:02d}'
+
+
+def format_size(size):
+    if size is None:
+        return ''
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
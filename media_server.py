@@ -0,0 +1,152 @@
+"""A small static file server for recordings, journal media and chat images.
+
+Handing a URL to ``st.audio``/``st.video`` lets the browser fetch the file
+itself with Range requests, instead of Streamlit loading every recording
+into its in-memory media manager on each rerun. Files are served from a
+fixed set of directories with ``Accept-Ranges``, ``ETag`` and
+``Cache-Control`` headers.
+
+Run it next to the app (``python media_server.py --port 8502``) or let
+``app.py`` start it in a thread by setting ``MEDIA_SERVER_PORT``.
+"""
+import argparse
+import mimetypes
+import os
+import re
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote, unquote, urlsplit
+
+MEDIA_ROOTS = ('blobs', 'songs', 'journal', 'message_media')
+CHUNK_SIZE = 64 * 1024
+# uploads are written once (under their content hash, or a timestamped name before that) and never modified in place
+CACHE_CONTROL = 'public, max-age=604800'
+
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single-range header, None to send the whole file, or 'invalid'."""
+    m = _RANGE.match(header.strip()) if header else None
+    if not m:
+        return None
+    first, last = m.groups()
+    if not first and not last:
+        return 'invalid'
+    if not first:
+        # suffix range: the last N bytes
+        n = int(last)
+        if n == 0:
+            return 'invalid'
+        return max(0, size - n), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return 'invalid'
+    return start, end
+
+
+def etag_for(st):
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    roots = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _resolve(self):
+        parts = unquote(urlsplit(self.path).path).lstrip('/').split('/', 1)
+        if len(parts) != 2 or parts[0] not in self.roots:
+            return None
+        root = self.roots[parts[0]].resolve()
+        target = (root / parts[1]).resolve()
+        if root not in target.parents or not target.is_file():
+            return None
+        return target
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _serve(self, body):
+        path = self._resolve()
+        if path is None:
+            self.send_error(404)
+            return
+        st = path.stat()
+        size = st.st_size
+        etag = etag_for(st)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', CACHE_CONTROL)
+            self.end_headers()
+            return
+        rng = parse_range(self.headers.get('Range'), size)
+        if_range = self.headers.get('If-Range')
+        if rng is not None and if_range and if_range != etag:
+            # the client's partial copy is stale; send the whole thing
+            rng = None
+        if rng == 'invalid':
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.end_headers()
+            return
+        start, end = rng if rng else (0, size - 1)
+        length = max(0, end - start + 1)
+        self.send_response(206 if rng else 200)
+        self.send_header('Content-Type', mimetypes.guess_type(path.name)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(st.st_mtime, usegmt=True))
+        self.send_header('Cache-Control', CACHE_CONTROL)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if rng:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if not body:
+            return
+        try:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = length
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # players routinely drop a connection once they have the bytes they wanted
+            pass
+
+
+def start(host='127.0.0.1', port=8502, roots=MEDIA_ROOTS):
+    """Start the server in a daemon thread and return it."""
+    handler = type('Handler', (MediaHandler,), {'roots': {name: Path(name) for name in roots}})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def url_for(base_url, path):
+    """URL of ``path`` (e.g. ``blobs/ab/ab12….mp3``, relative to the app folder) on a server reachable at ``base_url``."""
+    return f"{base_url.rstrip('/')}/" + '/'.join(quote(part) for part in Path(path).parts)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=os.getenv('MEDIA_SERVER_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('MEDIA_SERVER_PORT', '8502')))
+    args = parser.parse_args()
+    start(args.host, args.port)
+    print(f"serving {', '.join(MEDIA_ROOTS)} on http://{args.host}:{args.port}")
+    threading.Event().wait()
@@ -0,0 +1,640 @@
+"""Message storage backends used by the Messages tab.
+
+Two backends are available, selected with ``MESSAGE_STORAGE``:
+
+- ``file`` (default): ``messages.json`` snapshot plus a ``messages.jsonl`` log
+- ``sqlite``: messages kept in ``messages.db``
+
+Both expose the same small API (``load_messages``, ``get_message``,
+``add_message``, ``mark_all_read``, ``count_unread``, ``add_reply``,
+``add_reaction``, ``fetch_messages_since``, ``change_token``) so ``app.py``
+doesn't need to care which one is active.
+Messages are addressed by their integer ``id``; ``add_message`` and
+``add_reply`` return the new id. ``load_messages(before_id, limit)`` returns
+the ``limit`` newest messages older than ``before_id``, oldest first.
+``change_token()`` is a cheap value that changes whenever the store is written
+to, so callers can skip ``fetch_messages_since`` when nothing happened. Stores are meant to be created once per process
+and shared between sessions.
+"""
+import bisect
+import copy
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import metrics
+
+
+class MessageState:
+    """Messages in send order plus an id -> message index.
+
+    Every message gets an integer ``id`` that never changes; messages from
+    before ids existed are numbered in order when they are first loaded.
+    """
+
+    def __init__(self, messages=()):
+        self.messages = []
+        self.ids = []
+        self.by_id = {}
+        # recipient -> their unread messages, so counts and "mark all read" don't scan the history
+        self.unread = {}
+        self.next_id = 1
+        # replies are numbered from the same counter, so their ids count too
+        for m in messages:
+            if isinstance(m.get('id'), int):
+                self.next_id = max(self.next_id, m['id'] + 1)
+            for r in m.get('replies') or ():
+                if isinstance(r.get('id'), int):
+                    self.next_id = max(self.next_id, r['id'] + 1)
+        for m in messages:
+            self._insert(m)
+
+    def _insert(self, msg):
+        if not isinstance(msg.get('id'), int):
+            msg['id'] = self.next_id
+        self.next_id = max(self.next_id, msg['id'] + 1)
+        self.messages.append(msg)
+        self.ids.append(msg['id'])
+        self.by_id[msg['id']] = msg
+        if not msg.get('read'):
+            self.unread.setdefault(msg.get('to'), []).append(msg)
+
+    def page(self, before_id=None, limit=None):
+        # ids only ever grow, so the list is sorted and bisect finds the page edge
+        end = len(self.ids) if before_id is None else bisect.bisect_left(self.ids, before_id)
+        start = 0 if limit is None else max(0, end - limit)
+        return self.messages[start:end]
+
+    def since(self, last_id):
+        return self.messages[bisect.bisect_right(self.ids, last_id):]
+
+    def apply(self, event):
+        """Apply one log event; returns False if its parent message doesn't exist."""
+        op = event.get('op')
+        if op == 'add':
+            self._insert(event['msg'])
+            return True
+        if op == 'read':
+            for m in self.unread.pop(event.get('to'), []):
+                m['read'] = True
+            return True
+        parent = self.by_id.get(event.get('parent'))
+        if parent is None:
+            return False
+        if op == 'reply':
+            reply = event['msg']
+            if not isinstance(reply.get('id'), int):
+                reply['id'] = self.next_id
+            self.next_id = max(self.next_id, reply['id'] + 1)
+            parent.setdefault('replies', []).append(reply)
+            return True
+        if op == 'react':
+            reacts = parent.setdefault('reactions', {})
+            reacts[event['emoji']] = reacts.get(event['emoji'], 0) + 1
+            return True
+        return False
+
+
+def _stat(path):
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _read_snapshot(path):
+    # snapshots are {"seq": N, "messages": [...]}; a bare list is an older messages.json
+    try:
+        raw = path.read_bytes()
+        metrics.count('file_reads')
+        metrics.count('bytes_read', len(raw))
+        data = json.loads(raw)
+        metrics.count('json_parses')
+    except Exception:
+        return 0, []
+    if isinstance(data, list):
+        return 0, data
+    return data.get('seq', 0), data.get('messages', [])
+
+
+def _write_synced(path, data):
+    # fsynced, so a file renamed into place afterwards is complete on disk
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    metrics.count('bytes_written', len(data))
+
+
+def _sync_dir(path):
+    # makes a rename inside the directory durable; not possible on every platform
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _iter_log(data):
+    # yields (end_offset, event) for each complete line; a torn last line is left alone
+    pos = 0
+    while True:
+        nl = data.find(b'\n', pos)
+        if nl < 0:
+            return
+        line = data[pos:nl]
+        pos = nl + 1
+        if line.strip():
+            metrics.count('json_parses')
+            try:
+                yield pos, json.loads(line)
+            except Exception:
+                continue
+
+
+class FileMessageStore:
+    """File backend: a snapshot in ``messages.json`` plus an append-only ``messages.jsonl`` log.
+
+    Sends, read marks, replies and reactions each append one small event line.
+    Every ``compact_every`` events a background thread folds the log into a new
+    snapshot. Events carry an increasing ``seq`` and the snapshot records the
+    last one it contains, so a crash mid-compaction never applies an event twice.
+    """
+
+    def __init__(self, path, compact_every=1000):
+        self.path = Path(path)
+        self.log_path = self.path.with_suffix('.jsonl')
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._compacting = False
+        self._state = MessageState()
+        self._seq = 0
+        self._snapshot_seq = 0
+        self._snapshot_stat = None
+        self._log_offset = 0
+        self._log_events = 0
+
+    def _load_snapshot(self):
+        self._snapshot_stat = _stat(self.path)
+        self._snapshot_seq, messages = _read_snapshot(self.path)
+        self._state = MessageState(messages)
+        self._seq = self._snapshot_seq
+        self._log_offset = 0
+        self._log_events = 0
+        self._loaded = True
+
+    def _sync(self):
+        # bring the in-memory state up to date with whatever is on disk; caller holds the lock
+        log_stat = _stat(self.log_path)
+        log_size = log_stat[1] if log_stat else 0
+        if not self._loaded or _stat(self.path) != self._snapshot_stat or log_size < self._log_offset:
+            self._load_snapshot()
+        if log_size == self._log_offset:
+            return
+        with open(self.log_path, 'rb') as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        metrics.count('file_reads')
+        metrics.count('bytes_read', len(data))
+        end = 0
+        for end, event in _iter_log(data):
+            seq = event.get('seq', 0)
+            if seq > self._snapshot_seq:
+                self._log_events += 1
+            if seq <= self._seq:
+                continue
+            self._state.apply(event)
+            self._seq = seq
+        self._log_offset += end
+
+    def _append(self, event):
+        # raises OSError if the event couldn't be written
+        with self._lock:
+            self._sync()
+            if event['op'] in ('reply', 'react') and event.get('parent') not in self._state.by_id:
+                return False
+            if event['op'] in ('add', 'reply'):
+                # numbered before the write so the logged line carries the id
+                event['msg']['id'] = self._state.next_id
+            event['seq'] = self._seq + 1
+            line = json.dumps(event, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+            with open(self.log_path, 'ab') as f:
+                start = f.tell()
+                try:
+                    if start > self._log_offset:
+                        # start on a fresh line if the log ends with a torn write
+                        f.write(b'\n')
+                    f.write(line)
+                    f.flush()
+                except OSError:
+                    # don't leave half an event behind for the next sync to pick up
+                    try:
+                        f.truncate(start)
+                    except OSError:
+                        pass
+                    raise
+            metrics.count('bytes_written', len(line))
+            # only a written event becomes visible; an OSError above leaves the state untouched
+            self._state.apply(event)
+            self._seq = event['seq']
+            # our own line is picked up (and skipped by seq) on the next sync
+            if self._log_events + 1 >= self.compact_every and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self._compact, daemon=True).start()
+        return True
+
+    def compact(self):
+        with self._lock:
+            if self._compacting:
+                return False
+            self._compacting = True
+        self._compact()
+        return True
+
+    def _compact(self):
+        try:
+            with self._lock:
+                self._sync()
+                upto = self._log_offset
+            # fold from the files rather than the live state so sends aren't blocked meanwhile
+            seq, messages = _read_snapshot(self.path)
+            state = MessageState(messages)
+            try:
+                with open(self.log_path, 'rb') as f:
+                    data = f.read(upto)
+            except OSError:
+                data = b''
+            for _, event in _iter_log(data):
+                if event.get('seq', 0) > seq:
+                    state.apply(event)
+                    seq = event['seq']
+            tmp = self.path.with_name(self.path.name + '.tmp')
+            # on disk before the log is cut below, or a crash could lose what only the log held
+            _write_synced(tmp, json.dumps({'seq': seq, 'messages': state.messages}, ensure_ascii=False,
+                                          separators=(',', ':')).encode('utf-8'))
+            with self._lock:
+                os.replace(tmp, self.path)
+                _sync_dir(self.path.parent)
+                # keep only what was appended while we were folding
+                try:
+                    with open(self.log_path, 'rb') as f:
+                        f.seek(upto)
+                        tail = f.read()
+                except OSError:
+                    tail = b''
+                tmp_log = self.log_path.with_name(self.log_path.name + '.tmp')
+                _write_synced(tmp_log, tail)
+                os.replace(tmp_log, self.log_path)
+                self._snapshot_stat = _stat(self.path)
+                self._snapshot_seq = seq
+                self._log_offset = 0
+                self._log_events = 0
+        except Exception:
+            pass
+        finally:
+            self._compacting = False
+
+    def load_messages(self, before_id=None, limit=None):
+        with self._lock:
+            self._sync()
+            return copy.deepcopy(self._state.page(before_id, limit))
+
+    def fetch_messages_since(self, last_id):
+        with self._lock:
+            self._sync()
+            return copy.deepcopy(self._state.since(last_id))
+
+    def change_token(self):
+        # any append or compaction changes the mtime/size of one of the two files
+        return (_stat(self.path), _stat(self.log_path))
+
+    def count_unread(self, recipient):
+        with self._lock:
+            self._sync()
+            return len(self._state.unread.get(recipient, ()))
+
+    def get_message(self, msg_id):
+        with self._lock:
+            self._sync()
+            m = self._state.by_id.get(msg_id)
+            return copy.deepcopy(m) if m is not None else None
+
+    def add_message(self, msg):
+        msg = copy.deepcopy(msg)
+        msg.pop('id', None)
+        self._append({'op': 'add', 'msg': msg})
+        return msg['id']
+
+    def mark_all_read(self, recipient):
+        with self._lock:
+            self._sync()
+            if self._state.unread.get(recipient):
+                self._append({'op': 'read', 'to': recipient})
+
+    def add_reply(self, parent_id, reply_msg):
+        reply = copy.deepcopy(reply_msg)
+        reply.pop('id', None)
+        if not self._append({'op': 'reply', 'parent': parent_id, 'msg': reply}):
+            return None
+        return reply['id']
+
+    def add_reaction(self, parent_id, emoji, who):
+        return self._append({'op': 'react', 'parent': parent_id, 'emoji': emoji, 'who': who})
+
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender TEXT,
+        recipient TEXT,
+        text TEXT,
+        time TEXT,
+        read INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_messages_recipient_read ON messages (recipient, read)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_time ON messages (time)",
+]
+
+# Schema changes applied in order on top of SCHEMA; PRAGMA user_version records
+# how many have run.
+MIGRATIONS = [
+    [
+        "ALTER TABLE messages ADD COLUMN images TEXT",
+        """
+        CREATE TABLE replies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            parent_id INTEGER NOT NULL REFERENCES messages (id),
+            sender TEXT,
+            recipient TEXT,
+            text TEXT,
+            time TEXT
+        )
+        """,
+        "CREATE INDEX idx_replies_parent ON replies (parent_id)",
+        """
+        CREATE TABLE reactions (
+            message_id INTEGER NOT NULL REFERENCES messages (id),
+            emoji TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (message_id, emoji)
+        ) WITHOUT ROWID
+        """,
+    ],
+    [
+        # unread messages per recipient, kept in step with messages.read by add_message/mark_all_read
+        """
+        CREATE TABLE unread_counts (
+            recipient TEXT PRIMARY KEY,
+            n INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO unread_counts (recipient, n)
+        SELECT COALESCE(recipient, ''), COUNT(*) FROM messages WHERE read = 0 GROUP BY COALESCE(recipient, '')
+        """,
+    ],
+]
+
+# Statements are kept as constants so each pooled connection compiles them
+# once and reuses them from its statement cache.
+# newest page first; id < ? with LIMIT walks the primary key, so any page costs the same
+SELECT_PAGE = """
+    SELECT id, sender, recipient, text, time, read, images FROM messages
+    WHERE id < ? ORDER BY id DESC LIMIT ?
+"""
+SELECT_ONE = "SELECT id, sender, recipient, text, time, read, images FROM messages WHERE id = ?"
+SELECT_SINCE = """
+    SELECT id, sender, recipient, text, time, read, images FROM messages
+    WHERE id > ? ORDER BY id ASC
+"""
+SELECT_REPLIES_RANGE = """
+    SELECT id, parent_id, sender, recipient, text, time FROM replies
+    WHERE parent_id BETWEEN ? AND ? ORDER BY id ASC
+"""
+SELECT_REPLIES_FOR = "SELECT id, parent_id, sender, recipient, text, time FROM replies WHERE parent_id = ? ORDER BY id ASC"
+SELECT_REACTIONS_RANGE = "SELECT message_id, emoji, count FROM reactions WHERE message_id BETWEEN ? AND ?"
+COUNT_UNREAD = "SELECT n FROM unread_counts WHERE recipient = ?"
+BUMP_UNREAD = """
+    INSERT INTO unread_counts (recipient, n) VALUES (?, 1)
+    ON CONFLICT (recipient) DO UPDATE SET n = n + 1
+"""
+CLEAR_UNREAD = "UPDATE unread_counts SET n = 0 WHERE recipient = ?"
+SELECT_REACTIONS_FOR = "SELECT message_id, emoji, count FROM reactions WHERE message_id = ?"
+INSERT_MESSAGE = "INSERT INTO messages (sender, recipient, text, time, read, images) VALUES (?, ?, ?, ?, ?, ?)"
+INSERT_REPLY = """
+    INSERT INTO replies (parent_id, sender, recipient, text, time)
+    SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM messages WHERE id = ?)
+"""
+UPSERT_REACTION = """
+    INSERT INTO reactions (message_id, emoji, count)
+    SELECT ?, ?, 1 WHERE EXISTS (SELECT 1 FROM messages WHERE id = ?)
+    ON CONFLICT (message_id, emoji) DO UPDATE SET count = count + 1
+"""
+MARK_READ = "UPDATE messages SET read = 1 WHERE recipient = ? AND read = 0"
+MAX_ID = 2 ** 63 - 1
+
+
+def _row_to_message(r):
+    return {'id': r['id'], 'from': r['sender'], 'to': r['recipient'], 'text': r['text'], 'time': r['time'],
+            'read': bool(r['read']), 'images': json.loads(r['images']) if r['images'] else []}
+
+
+def _row_to_reply(r):
+    return {'id': r['id'], 'from': r['sender'], 'to': r['recipient'], 'text': r['text'], 'time': r['time']}
+
+
+def _attach(by_id, reply_rows, reaction_rows):
+    for r in reply_rows:
+        parent = by_id.get(r['parent_id'])
+        if parent is not None:
+            parent.setdefault('replies', []).append(_row_to_reply(r))
+    for r in reaction_rows:
+        parent = by_id.get(r['message_id'])
+        if parent is not None:
+            parent.setdefault('reactions', {})[r['emoji']] = r['count']
+
+
+class SqliteMessageStore:
+    def __init__(self, path, pool_size=4, timeout=5.0):
+        self.path = Path(path)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pool = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.init_db()
+        # a connection outside the pool whose only job is PRAGMA data_version:
+        # the value moves whenever any other connection (or process) commits
+        self._watch = self._connect()
+        self._watch_lock = threading.Lock()
+
+    def _connect(self):
+        # autocommit mode; write transactions are opened explicitly with BEGIN IMMEDIATE
+        conn = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=64)
+        conn.row_factory = sqlite3.Row
+        # counts statements toward the current rerun when metrics are on
+        conn.set_trace_callback(metrics.sqlite_trace)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.pool_size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        # take the write lock up front so concurrent writers queue on busy_timeout
+        # instead of failing with "database is locked" on lock upgrade
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def init_db(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.transaction() as conn:
+            for stmt in SCHEMA:
+                conn.execute(stmt)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for stmts in MIGRATIONS[version:]:
+                for stmt in stmts:
+                    conn.execute(stmt)
+            conn.execute(f"PRAGMA user_version={len(MIGRATIONS)}")
+
+    def close(self):
+        self._watch.close()
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+    def load_messages(self, before_id=None, limit=None):
+        # a page is a contiguous id range, so its replies and reactions are two range scans
+        before = MAX_ID if before_id is None else before_id
+        with self.connection() as conn:
+            msgs = [_row_to_message(r) for r in conn.execute(SELECT_PAGE, (before, -1 if limit is None else limit))]
+            msgs.reverse()
+            if msgs:
+                lo, hi = msgs[0]['id'], msgs[-1]['id']
+                _attach({m['id']: m for m in msgs}, conn.execute(SELECT_REPLIES_RANGE, (lo, hi)),
+                        conn.execute(SELECT_REACTIONS_RANGE, (lo, hi)))
+        return msgs
+
+    def fetch_messages_since(self, last_id):
+        with self.connection() as conn:
+            msgs = [_row_to_message(r) for r in conn.execute(SELECT_SINCE, (last_id,))]
+            if msgs:
+                lo, hi = msgs[0]['id'], msgs[-1]['id']
+                _attach({m['id']: m for m in msgs}, conn.execute(SELECT_REPLIES_RANGE, (lo, hi)),
+                        conn.execute(SELECT_REACTIONS_RANGE, (lo, hi)))
+        return msgs
+
+    def change_token(self):
+        with self._watch_lock:
+            return self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def count_unread(self, recipient):
+        with self.connection() as conn:
+            row = conn.execute(COUNT_UNREAD, (recipient,)).fetchone()
+        return row[0] if row else 0
+
+    def get_message(self, msg_id):
+        with self.connection() as conn:
+            r = conn.execute(SELECT_ONE, (msg_id,)).fetchone()
+            if r is None:
+                return None
+            m = _row_to_message(r)
+            _attach({m['id']: m}, conn.execute(SELECT_REPLIES_FOR, (msg_id,)),
+                    conn.execute(SELECT_REACTIONS_FOR, (msg_id,)))
+        return m
+
+    def add_message(self, msg):
+        with self.transaction() as conn:
+            cur = conn.execute(INSERT_MESSAGE, (msg.get('from'), msg.get('to'), msg.get('text'), msg.get('time'),
+                                                int(bool(msg.get('read'))),
+                                                json.dumps(msg.get('images') or [], ensure_ascii=False)))
+            if not msg.get('read'):
+                conn.execute(BUMP_UNREAD, (msg.get('to') or '',))
+            return cur.lastrowid
+
+    def mark_all_read(self, recipient):
+        # one indexed update on (recipient, read) plus resetting the counter, in one transaction
+        with self.transaction() as conn:
+            conn.execute(MARK_READ, (recipient,))
+            conn.execute(CLEAR_UNREAD, (recipient,))
+
+    def add_reply(self, parent_id, reply_msg):
+        with self.transaction() as conn:
+            cur = conn.execute(INSERT_REPLY, (parent_id, reply_msg.get('from'), reply_msg.get('to'),
+                                              reply_msg.get('text'), reply_msg.get('time'), parent_id))
+            return cur.lastrowid if cur.rowcount else None
+
+    def add_reaction(self, parent_id, emoji, who):
+        with self.transaction() as conn:
+            return conn.execute(UPSERT_REACTION, (parent_id, emoji, parent_id)).rowcount > 0
+
+
+def open_store(storage, messages_file='messages.json', db_file='messages.db'):
+    if storage == 'sqlite':
+        return SqliteMessageStore(db_file)
+    return FileMessageStore(messages_file)
+
+
+def iter_messages(store, page_size=1000):
+    """Every message in the store, newest page first, fetched one ``load_messages`` page at a time.
+
+    For scans over the whole history that shouldn't hold the store (or a
+    copy of all of it) for their whole duration.
+    """
+    before_id = None
+    while True:
+        page = store.load_messages(before_id=before_id, limit=page_size)
+        if not page:
+            return
+        yield from page
+        before_id = page[0]['id']
@@ -0,0 +1,94 @@
+"""Per-rerun timings and I/O counters.
+
+``start()`` begins collecting for the current script run. From then until
+``finish()``, ``section()`` times named blocks and ``count()`` adds to
+counters such as ``file_reads``, ``bytes_read``, ``bytes_written``,
+``json_parses`` and ``sqlite_queries``. Storage modules call ``count()``
+unconditionally. The collector lives in a context variable, so each session's
+script thread has its own numbers. Calls made outside a collecting run
+(background threads, or the app with metrics off) are no-ops.
+
+``append_jsonl`` writes one record per rerun to a JSON-lines file that is
+rotated to ``<name>.1`` once it reaches ``max_bytes``.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+_current = contextvars.ContextVar('metrics', default=None)
+_file_lock = threading.Lock()
+
+
+class RerunMetrics:
+    def __init__(self, label=''):
+        self.label = label
+        self.started = time.perf_counter()
+        # name -> seconds; a name used twice accumulates
+        self.sections = {}
+        self.counters = {}
+
+
+def start(label=''):
+    m = RerunMetrics(label)
+    _current.set(m)
+    return m
+
+
+def current():
+    return _current.get()
+
+
+def count(name, n=1):
+    m = _current.get()
+    if m is not None:
+        m.counters[name] = m.counters.get(name, 0) + n
+
+
+@contextmanager
+def section(name):
+    m = _current.get()
+    if m is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        m.sections[name] = m.sections.get(name, 0.0) + time.perf_counter() - t0
+
+
+def sqlite_trace(statement):
+    # for Connection.set_trace_callback; runs in the thread executing the statement
+    count('sqlite_queries')
+
+
+def finish():
+    """Stop collecting; returns the run as a plain dict, or None if nothing was being collected."""
+    m = _current.get()
+    if m is None:
+        return None
+    _current.set(None)
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'label': m.label,
+        'total_ms': round((time.perf_counter() - m.started) * 1000, 2),
+        'sections_ms': {k: round(v * 1000, 2) for k, v in m.sections.items()},
+        'counters': dict(m.counters),
+    }
+
+
+def append_jsonl(path, record, max_bytes=5 * 1024 * 1024):
+    path = Path(path)
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with _file_lock:
+        try:
+            if path.exists() and path.stat().st_size + len(line) > max_bytes:
+                os.replace(path, path.with_name(path.name + '.1'))
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError:
+            pass
@@ -0,0 +1,465 @@
+"""Move the message history between the ``file`` and ``sqlite`` backends.
+
+    python migrate.py import messages.json messages.db    # file store -> sqlite
+    python migrate.py export messages.db messages.json    # sqlite -> file store
+    python migrate.py verify messages.json messages.db    # compare counts and checksums
+
+``import`` reads the snapshot with an incremental JSON parser (one message
+in memory at a time, plus a read buffer). It then replays the
+``messages.jsonl`` log on top, and writes everything with batched
+``executemany`` in a single transaction, so a failed import leaves the
+database as it was. Messages without an id (from before ids existed) get
+the same ids the file backend gives them; replies are numbered by sqlite in
+the order they are imported. A missing ``messages.json`` (a file store that
+hasn't compacted yet) counts as empty. ``export`` streams the tables
+back out in id order into a new snapshot. Both run ``verify`` afterwards
+unless ``--no-verify`` is given. ``verify`` streams both sides as well, so
+none of the three commands holds the whole history in memory.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+from pathlib import Path
+
+import message_store
+
+CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 5000
+
+_WS = re.compile(r'\s*')
+_SEQ_HEAD = re.compile(rb'\s*\{\s*"seq"\s*:\s*(\d+)')
+
+
+class SnapshotReader:
+    """Iterate over the messages of a ``messages.json`` snapshot without loading the whole file.
+
+    Accepts ``{"seq": N, "messages": [...]}`` (keys in any order) or a bare
+    list. ``seq`` is filled in as it is read, so it is final once iteration ends.
+    A missing file reads as no messages: a file store only writes its first
+    snapshot when it compacts, so until then everything is in the log.
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self.seq = 0
+        self._decoder = json.JSONDecoder()
+
+    def __iter__(self):
+        self._buf, self._pos, self._eof = '', 0, False
+        if not self.path.exists():
+            return
+        with open(self.path, 'r', encoding='utf-8') as self._f:
+            c = self._peek()
+            if c == '[':
+                yield from self._array()
+            elif c == '{':
+                self._pos += 1
+                while self._peek() != '}':
+                    key = self._decode()
+                    self._expect(':')
+                    if key == 'messages' and self._peek() == '[':
+                        yield from self._array()
+                    else:
+                        value = self._decode()
+                        if key == 'seq':
+                            self.seq = value
+                    if self._peek() == ',':
+                        self._pos += 1
+            elif c:
+                raise ValueError(f'{self.path}: expected a JSON object or list')
+
+    def _fill(self):
+        data = self._f.read(self.chunk_size)
+        if not data:
+            self._eof = True
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+
+    def _peek(self):
+        while True:
+            self._pos = _WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf) or self._eof:
+                return self._buf[self._pos:self._pos + 1]
+            self._fill()
+
+    def _expect(self, ch):
+        if self._peek() != ch:
+            raise ValueError(f'{self.path}: expected {ch!r}')
+        self._pos += 1
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                self._fill()
+                continue
+            # a number at the very end of the buffer may continue in the next chunk
+            if end == len(self._buf) and not self._eof:
+                self._fill()
+                continue
+            self._pos = end
+            return value
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._decode()
+            c = self._peek()
+            self._pos += 1
+            if c == ']':
+                return
+            if c != ',':
+                raise ValueError(f'{self.path}: expected , or ] in the messages list')
+
+
+def iter_log(path):
+    """Events of a ``messages.jsonl`` log, one line at a time; a torn last line is skipped."""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def snapshot_seq(path):
+    # snapshots written by the app start with their seq; reading the head is enough
+    try:
+        with open(path, 'rb') as f:
+            m = _SEQ_HEAD.match(f.read(64))
+    except FileNotFoundError:
+        return 0
+    return int(m.group(1)) if m else 0
+
+
+def last_log_seq(path):
+    seq = 0
+    for event in iter_log(path):
+        seq = max(seq, event.get('seq', 0))
+    return seq
+
+
+def _message_row(mid, m):
+    images = m.get('images')
+    return (mid, m.get('from'), m.get('to'), m.get('text'), m.get('time'), int(bool(m.get('read'))),
+            json.dumps(images, ensure_ascii=False) if images else '[]')
+
+
+INSERT_MESSAGE = "INSERT INTO messages (id, sender, recipient, text, time, read, images) VALUES (?, ?, ?, ?, ?, ?, ?)"
+INSERT_REPLY = "INSERT INTO replies (id, parent_id, sender, recipient, text, time) VALUES (?, ?, ?, ?, ?, ?)"
+INSERT_REACTION = "INSERT INTO reactions (message_id, emoji, count) VALUES (?, ?, ?)"
+LOG_REPLY = """
+    INSERT INTO replies (id, parent_id, sender, recipient, text, time)
+    SELECT ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM messages WHERE id = ?)
+"""
+LOG_READ = "UPDATE messages SET read = 1 WHERE recipient IS ? AND read = 0"
+
+
+def import_json(json_path, db_path, replace=False, batch_size=BATCH_SIZE):
+    json_path, db_path = Path(json_path), Path(db_path)
+    log_path = json_path.with_suffix('.jsonl')
+    created = not db_path.exists()
+    store = message_store.SqliteMessageStore(db_path)
+    stats = {'messages': 0, 'replies': 0, 'reactions': 0, 'log_events': 0}
+    try:
+        with store.transaction() as conn:
+            # the metrics trace would run once per executemany row
+            conn.set_trace_callback(None)
+            if conn.execute("SELECT EXISTS (SELECT 1 FROM messages)").fetchone()[0]:
+                if not replace:
+                    raise SystemExit(f'{db_path} already has messages; pass --replace to overwrite them')
+                for table in ('reactions', 'replies', 'messages', 'unread_counts'):
+                    conn.execute(f"DELETE FROM {table}")
+            msgs, replies, reactions = [], [], []
+
+            def flush():
+                conn.executemany(INSERT_MESSAGE, msgs)
+                conn.executemany(INSERT_REPLY, replies)
+                conn.executemany(INSERT_REACTION, reactions)
+                msgs.clear()
+                replies.clear()
+                reactions.clear()
+
+            # messages without an id get max(id) + 1, + 2, ... in file order, as the file
+            # backend numbers them; until max(id) is known they are stored as -1, -2, ...
+            max_id, missing = 0, 0
+            reader = SnapshotReader(json_path)
+            for m in reader:
+                if isinstance(m.get('id'), int):
+                    mid = m['id']
+                    max_id = max(max_id, mid)
+                else:
+                    missing += 1
+                    mid = -missing
+                msgs.append(_message_row(mid, m))
+                # sqlite numbers the replies in insertion order, which keeps each message's
+                # replies in order (the file ids, where there are any, share a counter with
+                # messages and may collide with the numbers given to older id-less replies)
+                replies.extend((None, mid, r.get('from'), r.get('to'), r.get('text'), r.get('time'))
+                               for r in m.get('replies') or ())
+                reactions.extend((mid, e, n) for e, n in (m.get('reactions') or {}).items())
+                stats['messages'] += 1
+                stats['replies'] += len(m.get('replies') or ())
+                stats['reactions'] += len(m.get('reactions') or {})
+                if len(msgs) >= batch_size:
+                    flush()
+            flush()
+            if missing:
+                conn.execute("UPDATE messages SET id = ? - id WHERE id < 0", (max_id,))
+                conn.execute("UPDATE replies SET parent_id = ? - parent_id WHERE parent_id < 0", (max_id,))
+                conn.execute("UPDATE reactions SET message_id = ? - message_id WHERE message_id < 0", (max_id,))
+
+            # then whatever the log holds beyond the snapshot, in order (skipping repeats, as the file backend does)
+            seq = reader.seq
+            for event in iter_log(log_path):
+                if event.get('seq', 0) <= seq:
+                    continue
+                seq = event['seq']
+                op = event.get('op')
+                if op == 'add':
+                    m = event['msg']
+                    conn.execute(INSERT_MESSAGE, _message_row(m['id'], m))
+                    stats['messages'] += 1
+                elif op == 'read':
+                    conn.execute(LOG_READ, (event.get('to'),))
+                elif op == 'reply':
+                    r = event['msg']
+                    cur = conn.execute(LOG_REPLY, (None, event.get('parent'), r.get('from'), r.get('to'),
+                                                   r.get('text'), r.get('time'), event.get('parent')))
+                    stats['replies'] += cur.rowcount
+                elif op == 'react':
+                    conn.execute(message_store.UPSERT_REACTION, (event.get('parent'), event['emoji'],
+                                                                 event.get('parent')))
+                else:
+                    continue
+                stats['log_events'] += 1
+
+            # explicit ids don't move AUTOINCREMENT past them on UPDATE; do it by hand
+            for table in ('messages', 'replies'):
+                conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+                conn.execute(f"INSERT INTO sqlite_sequence (name, seq) SELECT ?, COALESCE(MAX(id), 0) FROM {table}",
+                             (table,))
+            conn.execute("DELETE FROM unread_counts")
+            # the same backfill the unread_counts migration runs
+            conn.execute(message_store.MIGRATIONS[1][1])
+    except BaseException:
+        store.close()
+        if created:
+            # don't leave an empty database behind for the app to pick up
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.unlink(f'{db_path}{suffix}')
+                except OSError:
+                    pass
+        raise
+    store.close()
+    return stats
+
+
+def iter_sqlite_messages(conn):
+    """Messages with their replies and reactions in id order, joined from three ordered scans."""
+    conn.row_factory = sqlite3.Row
+    replies = conn.execute("SELECT id, parent_id, sender, recipient, text, time FROM replies ORDER BY parent_id, id")
+    reactions = conn.execute("SELECT message_id, emoji, count FROM reactions ORDER BY message_id, emoji")
+    r, x = next(replies, None), next(reactions, None)
+    for row in conn.execute("SELECT id, sender, recipient, text, time, read, images FROM messages ORDER BY id"):
+        m = message_store._row_to_message(row)
+        while r is not None and r['parent_id'] <= m['id']:
+            if r['parent_id'] == m['id']:
+                m.setdefault('replies', []).append(message_store._row_to_reply(r))
+            r = next(replies, None)
+        while x is not None and x['message_id'] <= m['id']:
+            if x['message_id'] == m['id']:
+                m.setdefault('reactions', {})[x['emoji']] = x['count']
+            x = next(reactions, None)
+        yield m
+
+
+def export_json(db_path, json_path, force=False):
+    db_path, json_path = Path(db_path), Path(json_path)
+    log_path = json_path.with_suffix('.jsonl')
+    if json_path.exists() and not force:
+        raise SystemExit(f'{json_path} already exists; pass --force to replace it')
+    if not db_path.exists():
+        raise SystemExit(f'{db_path} does not exist')
+    # the new snapshot must claim every event already in the log, or the file
+    # backend would apply them again on top of it
+    seq = max(snapshot_seq(json_path), last_log_seq(log_path))
+    stats = {'messages': 0, 'replies': 0, 'reactions': 0}
+    tmp = json_path.with_name(json_path.name + '.tmp')
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(f'{{"seq":{seq},"messages":[')
+            for m in iter_sqlite_messages(conn):
+                if stats['messages']:
+                    f.write(',')
+                f.write(json.dumps(m, ensure_ascii=False, separators=(',', ':')))
+                stats['messages'] += 1
+                stats['replies'] += len(m.get('replies', ()))
+                stats['reactions'] += len(m.get('reactions', {}))
+            f.write(']}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, json_path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    finally:
+        conn.close()
+    if log_path.exists():
+        # everything in it is now part of the snapshot
+        log_path.write_bytes(b'')
+    return stats
+
+
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+def summarize(messages):
+    """Counts plus a SHA-256 over every message (fields the sqlite backend stores) in id order."""
+    digest = hashlib.sha256()
+    counts = {'messages': 0, 'replies': 0, 'reactions': 0, 'reaction_total': 0, 'unread': {}}
+    for m in messages:
+        replies = m.get('replies') or []
+        reacts = m.get('reactions') or {}
+        # reply ids aren't compared: replies from before ids existed only get one in sqlite
+        record = [m['id'], m.get('from'), m.get('to'), m.get('text'), m.get('time'), bool(m.get('read')),
+                  list(m.get('images') or []),
+                  [[r.get('from'), r.get('to'), r.get('text'), r.get('time')] for r in replies],
+                  sorted(reacts.items())]
+        digest.update(_encode(record).encode('utf-8') + b'\n')
+        counts['messages'] += 1
+        counts['replies'] += len(replies)
+        counts['reactions'] += len(reacts)
+        counts['reaction_total'] += sum(reacts.values())
+        if not m.get('read'):
+            to = m.get('to') or ''
+            counts['unread'][to] = counts['unread'].get(to, 0) + 1
+    counts['sha256'] = digest.hexdigest()
+    return counts
+
+
+def iter_file_messages(json_path):
+    """Messages of a file store in id order, as the file backend would load them, one at a time.
+
+    The snapshot is streamed. Only the log events past it are held in memory;
+    compaction keeps them to at most ``compact_every`` or so.
+    """
+    json_path = Path(json_path)
+    seq = snapshot_seq(json_path)
+    # messages the log adds, with every later event applied, exactly as MessageState does it
+    added = message_store.MessageState()
+    # events aimed at snapshot messages: recipients marked all-read, replies and reactions by parent
+    read_to, pending = set(), {}
+    for event in iter_log(json_path.with_suffix('.jsonl')):
+        if event.get('seq', 0) <= seq:
+            continue
+        seq = event['seq']
+        op = event.get('op')
+        if op == 'read':
+            read_to.add(event.get('to'))
+        elif op in ('reply', 'react') and event.get('parent') not in added.by_id:
+            pending.setdefault(event.get('parent'), []).append(event)
+            continue
+        added.apply(event)
+
+    def finish(m):
+        if not m.get('read') and m.get('to') in read_to:
+            m['read'] = True
+        for event in pending.get(m['id'], ()):
+            if event['op'] == 'reply':
+                m.setdefault('replies', []).append(event['msg'])
+            else:
+                reacts = m.setdefault('reactions', {})
+                reacts[event['emoji']] = reacts.get(event['emoji'], 0) + 1
+        return m
+
+    if not json_path.exists():
+        yield from added.messages
+        return
+    # snapshots are in id order; messages from before ids existed come after all of
+    # them (max id + 1, + 2, ... in file order), so they need a second pass
+    max_id, missing = 0, 0
+    for m in SnapshotReader(json_path):
+        if isinstance(m.get('id'), int):
+            max_id = max(max_id, m['id'])
+            yield finish(m)
+        else:
+            missing += 1
+    if missing:
+        k = 0
+        for m in SnapshotReader(json_path):
+            if not isinstance(m.get('id'), int):
+                k += 1
+                m['id'] = max_id + k
+                yield finish(m)
+    yield from added.messages
+
+
+def verify(json_path, db_path, out=sys.stdout):
+    a = summarize(iter_file_messages(json_path))
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        b = summarize(iter_sqlite_messages(conn))
+    finally:
+        conn.close()
+    ok = a == b
+    for key in ('messages', 'replies', 'reactions', 'reaction_total', 'unread', 'sha256'):
+        mark = 'ok' if a[key] == b[key] else 'MISMATCH'
+        print(f'{key:15} file={a[key]}  sqlite={b[key]}  {mark}', file=out)
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('import', help='copy messages.json (+ messages.jsonl) into a sqlite database')
+    p.add_argument('json_path', nargs='?', default='messages.json')
+    p.add_argument('db_path', nargs='?', default='messages.db')
+    p.add_argument('--replace', action='store_true', help='delete messages already in the database first')
+    p.add_argument('--no-verify', action='store_true')
+    p = sub.add_parser('export', help='write a sqlite database out as messages.json')
+    p.add_argument('db_path', nargs='?', default='messages.db')
+    p.add_argument('json_path', nargs='?', default='messages.json')
+    p.add_argument('--force', action='store_true', help='replace an existing messages.json')
+    p.add_argument('--no-verify', action='store_true')
+    p = sub.add_parser('verify', help='compare a file store and a sqlite database')
+    p.add_argument('json_path', nargs='?', default='messages.json')
+    p.add_argument('db_path', nargs='?', default='messages.db')
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        stats = import_json(args.json_path, args.db_path, replace=args.replace)
+    elif args.command == 'export':
+        stats = export_json(args.db_path, args.json_path, force=args.force)
+    else:
+        return 0 if verify(args.json_path, args.db_path) else 1
+    print(', '.join(f'{v} {k.replace("_", " ")}' for k, v in stats.items()))
+    if args.no_verify:
+        return 0
+    return 0 if verify(args.json_path, args.db_path) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Full-text search over messages, journal entries, letters and map pins.
+
+Everything lives in one SQLite FTS5 table in ``search.db``. Each source
+records how far it has been indexed: every entry whose ref (message id or
+list position) is below the source's position is in the index. Keeping the
+index current therefore only ever adds the new entries; nothing is rebuilt. ``search`` returns bm25-ranked, paginated hits with a
+short highlighted snippet.
+"""
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+import metrics
+
+SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(
+        title, body, kind UNINDEXED, ref UNINDEXED, time UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, position INTEGER NOT NULL) WITHOUT ROWID",
+]
+
+SELECT_POSITION = "SELECT position FROM sources WHERE name = ?"
+SET_POSITION = """
+    INSERT INTO sources (name, position) VALUES (?, ?)
+    ON CONFLICT (name) DO UPDATE SET position = excluded.position
+"""
+INSERT_DOC = "INSERT INTO docs (title, body, kind, ref, time) VALUES (?, ?, ?, ?, ?)"
+SEARCH = """
+    SELECT kind, ref, title, time, snippet(docs, 1, '**', '**', '…', 12) AS snippet
+    FROM docs WHERE docs MATCH ? ORDER BY rank LIMIT ? OFFSET ?
+"""
+SEARCH_KIND = """
+    SELECT kind, ref, title, time, snippet(docs, 1, '**', '**', '…', 12) AS snippet
+    FROM docs WHERE docs MATCH ? AND kind = ? ORDER BY rank LIMIT ? OFFSET ?
+"""
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_query(text):
+    """Turn free text into a safe FTS5 query: every word must match, the last one as a prefix."""
+    words = _WORD.findall(text or '')
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class SearchIndex:
+    def __init__(self, path='search.db'):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.set_trace_callback(metrics.sqlite_trace)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            for stmt in SCHEMA:
+                self._conn.execute(stmt)
+
+    def position(self, source):
+        with self._lock:
+            row = self._conn.execute(SELECT_POSITION, (source,)).fetchone()
+        return row[0] if row else 0
+
+    def add(self, source, docs, start, position):
+        """Index ``docs`` ((ref, title, body, time) tuples, refs from ``start`` up) and move ``source`` up to ``position``.
+
+        The stored position is checked inside the write transaction. Docs that
+        another caller indexed in the meantime are dropped, so overlapping
+        catch-ups don't create duplicates. If the source isn't indexed up to
+        ``start`` yet, nothing is added; the gap is left for a full catch-up.
+        """
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(SELECT_POSITION, (source,)).fetchone()
+                indexed = row[0] if row else 0
+                if indexed < start or indexed >= position:
+                    conn.execute("ROLLBACK")
+                    return False
+                conn.executemany(INSERT_DOC, ((title or '', body or '', source, ref, time or '')
+                                              for ref, title, body, time in docs if ref >= indexed))
+                conn.execute(SET_POSITION, (source, position))
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        return True
+
+    def add_list(self, source, items, to_doc):
+        """Index the items of an append-only list that aren't indexed yet."""
+        start = self.position(source)
+        if start >= len(items):
+            return False
+        return self.add(source, [to_doc(i, it) for i, it in enumerate(items[start:], start)], start, len(items))
+
+    def search(self, text, limit=20, offset=0, kind=None):
+        query = fts_query(text)
+        if not query:
+            return []
+        with self._lock:
+            if kind:
+                rows = self._conn.execute(SEARCH_KIND, (query, kind, limit, offset)).fetchall()
+            else:
+                rows = self._conn.execute(SEARCH, (query, limit, offset)).fetchall()
+        return [dict(r) for r in rows]
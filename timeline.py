@@ -0,0 +1,48 @@
+"""Memories timeline: every collection merged newest first.
+
+Each collection is kept in time order when it is written: entries are
+appended with ``stamp()``, which never goes backwards past the newest
+entry, so no tab or timeline has to sort anything on render. A source is
+then just a reversed walk over its list (or a generator over message pages),
+and ``merge`` combines them lazily with ``heapq.merge``. Taking a page with
+``page`` only pulls the entries up to the end of that page.
+"""
+import datetime
+import heapq
+from itertools import islice
+from operator import itemgetter
+
+
+def time_of(entry):
+    return entry.get('time') or ''
+
+
+def stamp(items):
+    """Current UTC time in ISO format, but not earlier than the newest entry of ``items`` (a list or dict).
+
+    A clock that steps back would otherwise put a new entry out of order.
+    """
+    now = datetime.datetime.utcnow().isoformat()
+    if isinstance(items, dict):
+        last = next(reversed(items.values()), None)
+    else:
+        last = items[-1] if items else None
+    latest = time_of(last) if last else ''
+    # only clamp to something that looks like an ISO timestamp
+    return max(now, latest) if latest[:4].isdigit() else now
+
+
+def newest_first(kind, items):
+    """Yield ``(time, kind, entry)`` for a time-ordered list or dict, newest first, without copying it."""
+    values = items.values() if isinstance(items, dict) else items
+    for entry in reversed(values):
+        yield time_of(entry), kind, entry
+
+
+def merge(*sources):
+    return heapq.merge(*sources, key=itemgetter(0), reverse=True)
+
+
+def page(stream, number, size):
+    """Entries of page ``number`` (0-based), plus one more if there is a next page."""
+    return list(islice(stream, number * size, (number + 1) * size + 1))
@@ -0,0 +1,44 @@
+"""Saving uploaded files to disk.
+
+Uploads are copied in fixed-size chunks into a hidden temp file next to the
+destination and renamed into place once complete, so a half-written file is
+never visible under its final name. The SHA-256 is computed while copying.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+import metrics
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def copy_stream(src, dest_path, chunk_size=CHUNK_SIZE):
+    """Copy the file object ``src`` to ``dest_path`` atomically; returns (sha256, size)."""
+    dest_path = Path(dest_path)
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=dest_path.parent, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, dest_path)
+        metrics.count('bytes_written', size)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return digest.hexdigest(), size
+
@@ -0,0 +1,146 @@
+"""Background delivery of webhook notifications.
+
+``WebhookDispatcher.submit`` only puts the event on a bounded in-process
+queue; a worker thread POSTs events to the webhook URL as
+``{"events": [...]}``, batching whatever arrives within ``batch_wait``
+seconds. Failed posts are retried with exponential backoff. Events that
+still can't be delivered (or don't fit in the queue) are appended to a spool
+file and sent again once the endpoint answers, or when the next process
+starts.
+"""
+import copy
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from pathlib import Path
+from urllib import request
+
+log = logging.getLogger(__name__)
+
+
+class WebhookDispatcher:
+    def __init__(self, url, spool_path='webhook_spool.jsonl', maxsize=1000, batch_size=20, batch_wait=0.5,
+                 max_retries=5, backoff=1.0, max_backoff=60.0, timeout=5.0):
+        self.url = url
+        self.spool_path = Path(spool_path)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize)
+        self.delivered = 0
+        self._spool_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='webhook-dispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, event):
+        """Queue ``event`` for delivery; never blocks. Returns False if it went to the spool instead.
+
+        The event is copied, so the caller may go on changing its own dict.
+        """
+        # the worker serializes it later, on another thread
+        event = copy.deepcopy(event)
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self._spool([event])
+            return False
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far has been delivered or spooled."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=5.0):
+        self.flush(timeout)
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _spool(self, events):
+        with self._spool_lock:
+            try:
+                with open(self.spool_path, 'a', encoding='utf-8') as f:
+                    for e in events:
+                        f.write(json.dumps(e, ensure_ascii=False) + '\n')
+            except Exception:
+                log.exception("could not spool %d webhook event(s)", len(events))
+
+    def _take_spool(self):
+        with self._spool_lock:
+            try:
+                lines = self.spool_path.read_text(encoding='utf-8').splitlines()
+                self.spool_path.unlink()
+            except FileNotFoundError:
+                return []
+        events = []
+        for line in lines:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+        return events
+
+    def _post(self, batch):
+        body = json.dumps({'events': batch}, ensure_ascii=False).encode('utf-8')
+        req = request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        with request.urlopen(req, timeout=self.timeout) as resp:
+            resp.read()
+
+    def _deliver(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._post(batch)
+                self.delivered += len(batch)
+                return True
+            except Exception as e:
+                if attempt == self.max_retries or self._stop.is_set():
+                    log.warning("webhook delivery failed after %d attempt(s): %s", attempt + 1, e)
+                    break
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                self._stop.wait(delay * random.uniform(0.5, 1.0))
+        self._spool(batch)
+        return False
+
+    def _resend_spool(self):
+        pending = self._take_spool()
+        for i in range(0, len(pending), self.batch_size):
+            if not self._deliver(pending[i:i + self.batch_size]):
+                # endpoint is down again; keep the rest for later
+                self._spool(pending[i + self.batch_size:])
+                return
+
+    def _run(self):
+        if self.spool_path.exists():
+            self._resend_spool()
+        while not self._stop.is_set():
+            try:
+                first = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                if self._deliver(batch) and self.spool_path.exists():
+                    self._resend_spool()
+            finally:
+                for _ in batch:
+                    self.queue.task_done()